@@ -0,0 +1,70 @@
+import math
+
+import pandas as pd
+
+# Columns of a summary table after the key fields
+SUMMARY_COLUMNS = ['runs', 'success_rate', 'time_to_depletion_count', 'time_to_depletion_mean',
+                   'time_to_depletion_std', 'time_to_depletion_min', 'time_to_depletion_max',
+                   'time_to_first_nectar_mean']
+
+
+class RunningStats:
+    """Count, mean, sample variance (Welford's update), min and max of a stream of
+    numbers, in constant memory. None and NaN are skipped."""
+
+    __slots__ = ('n', 'mean', 'm2', 'min', 'max')
+
+    def __init__(self):
+        self.n = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+
+    def add(self, x):
+        if x is None or x != x:
+            return
+        self.n += 1
+        delta = x - self.mean
+        self.mean += delta / self.n
+        self.m2 += delta * (x - self.mean)
+        self.min = min(self.min, x)
+        self.max = max(self.max, x)
+
+    def std(self):
+        return math.sqrt(self.m2 / (self.n - 1)) if self.n > 1 else math.nan
+
+
+class SweepSummary:
+    """Running per-config summary of a sweep's records, updated as each record
+    arrives: number of runs, success rate, count/mean/std/min/max of
+    time_to_depletion (set only for successful runs) and mean time_to_first_nectar.
+    Configs are identified by key_fields of the record, so memory grows with the
+    number of configs but not with the number of replicates."""
+
+    def __init__(self, key_fields):
+        self.key_fields = tuple(key_fields)
+        self.groups = {}
+
+    def add(self, record):
+        key = tuple(record[f] for f in self.key_fields)
+        group = self.groups.get(key)
+        if group is None:
+            group = self.groups[key] = [0, 0, RunningStats(), RunningStats()]
+        group[0] += 1
+        group[1] += bool(record['success'])
+        group[2].add(record['time_to_depletion'])
+        group[3].add(record['time_to_first_nectar'])
+
+    def __len__(self):
+        return len(self.groups)
+
+    def to_frame(self):
+        rows = []
+        for key, (runs, successes, ttd, ttfn) in self.groups.items():
+            solved = ttd.n > 0
+            rows.append((*key, runs, successes / runs, ttd.n, ttd.mean if solved else math.nan, ttd.std(),
+                         ttd.min if solved else math.nan, ttd.max if solved else math.nan,
+                         ttfn.mean if ttfn.n else math.nan))
+        return pd.DataFrame(rows, columns=[*self.key_fields, *SUMMARY_COLUMNS]).sort_values(
+            list(self.key_fields), ignore_index=True)
@@ -1,10 +1,13 @@
 import pandas as pd
 import numpy as np
 
+import store
+
 # --------------------------------------------------
-# Load pairwise results
+# Load pairwise results: the Parquet store if present, else the CSV,
+# streamed in chunks and reading only the columns used below
 # --------------------------------------------------
-df = pd.read_csv("pairwise_sensitivity_results.csv")
+source = store.resolve("pairwise_sensitivity_results.csv")
 
 # Parameters to analyze
 param_cols = ['idle_prob', 'follow_prob', 'perc_scouts',
@@ -13,20 +16,18 @@ param_cols = ['idle_prob', 'follow_prob', 'perc_scouts',
 # --------------------------------------------------
 # Step 1: Compute efficiency
 # --------------------------------------------------
-df['efficiency'] = df.apply(
-    lambda row: row['total_nectar_collected'] / row['time_to_depletion']
-    if row['time_to_depletion'] > 0 else 0.0, axis=1
-)
+def with_efficiency(chunks):
+    for df in chunks:
+        ttd = df['time_to_depletion']
+        df['efficiency'] = (df['total_nectar_collected'] / ttd).where(ttd > 0, 0.0)
+        yield df
+
+chunks = store.scan(source, param_cols + ['total_nectar_collected', 'time_to_depletion'])
 
 # --------------------------------------------------
 # Step 2: Aggregate over repetitions
 # --------------------------------------------------
-agg_df = df.groupby(param_cols).agg(
-    time_to_depletion_mean=('time_to_depletion', 'mean'),
-    time_to_depletion_std=('time_to_depletion', 'std'),
-    efficiency_mean=('efficiency', 'mean'),
-    efficiency_std=('efficiency', 'std')
-).reset_index()
+agg_df = store.grouped_stats(with_efficiency(chunks), param_cols, ['time_to_depletion', 'efficiency'])
 
 # --------------------------------------------------
 # Step 3: Compute parameter importance
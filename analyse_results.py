@@ -2,16 +2,21 @@ import pandas as pd
 import matplotlib.pyplot as plt
 import seaborn as sns
 
+import store
+
 # ---------------------------
-# Load results
+# Load results: the Parquet store if present, else the CSV (streamed in chunks)
 # ---------------------------
-df = pd.read_csv("bee_results.csv")
+source = store.resolve("bee_results.csv")
+params = ["idle_prob", "follow_prob", "perc_scouts", "kappa_0", "alpha", "beta", "w_dir"]
 
 # ---------------------------
 # Count failed replicates
 # ---------------------------
-num_failed = df['time_to_depletion'].isna().sum()
-total_runs = len(df)
+total_runs = num_failed = 0
+for ttd in store.scan(source, ['time_to_depletion']):
+    total_runs += len(ttd)
+    num_failed += ttd['time_to_depletion'].isna().sum()
 print(f"Total runs: {total_runs}")
 print(f"Failed runs (NaN time_to_depletion): {num_failed}")
 print(f"Successful runs: {total_runs - num_failed}\n")
@@ -19,19 +24,9 @@ print(f"Successful runs: {total_runs - num_failed}\n")
 # ---------------------------
 # Keep only the replicate with the quickest time_to_depletion per sample_id safely
 # ---------------------------
-agg_list = []
-
-for sample_id, group in df.groupby("sample_id"):
-    # Drop NaNs in this group
-    group_valid = group.dropna(subset=["time_to_depletion"])
-    if len(group_valid) == 0:
-        # skip parameter sets that failed all replicates
-        continue
-    # pick the row with minimum time_to_depletion
-    min_idx = group_valid["time_to_depletion"].idxmin()
-    agg_list.append(df.loc[min_idx])
-
-agg = pd.DataFrame(agg_list).reset_index(drop=True)
+# Parameter sets that failed all replicates have no row
+agg = store.fastest_per_group(store.scan(source, ["sample_id", "rep", *params, "time_to_depletion"]),
+                              "sample_id", "time_to_depletion")
 
 print("Aggregated results (quickest time_to_depletion per parameter set):")
 print(agg.head())
@@ -39,8 +34,6 @@ print(agg.head())
 # ---------------------------
 # Scatterplots: each parameter vs quickest time_to_depletion
 # ---------------------------
-params = ["idle_prob", "follow_prob", "perc_scouts", "kappa_0", "alpha", "beta", "w_dir"]
-
 plt.figure(figsize=(16, 10))
 for i, p in enumerate(params, 1):
     plt.subplot(2, 4, i)
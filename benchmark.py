@@ -0,0 +1,178 @@
+import argparse
+import contextlib
+import io
+import itertools
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from run import build_environment
+
+# Behavioural parameters shared by every benchmark case; the grid varies the rest
+BENCH_CONFIG = {'hive_radius': 0.2, 'max_nec_strength': 5, 'sense_range': 0.5, 'dt': 0.2,
+                'idle_prob': 0.2, 'follow_prob': 0.6, 'perc_scouts': 0.4,
+                'kappa_0': 2.5, 'alpha': 10, 'beta': 5, 'w_dir': 0.5}
+
+GRID = {'num_bees': [10, 100, 1000], 'nectar_count': [10, 100], 'size': [10, 50], 'max_steps': [200, 1000]}
+QUICK_GRID = {'num_bees': [10, 100], 'nectar_count': [10], 'size': [10], 'max_steps': [200]}
+
+# Throughput metrics regress when they drop, memory when it grows
+HIGHER_IS_BETTER = {'steps_per_sec': True, 'runs_per_sec': True, 'peak_mb': False, 'startup_sec': False}
+
+# Imports a sweep worker does before its first task, timed in a fresh interpreter
+STARTUP_SCRIPT = '''
+import resource, sys, time
+t0 = time.perf_counter()
+import {module}
+print(time.perf_counter() - t0, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)
+'''
+
+
+def bench_config(num_bees, nectar_count, size, max_steps):
+    return {**BENCH_CONFIG, 'num_bees': num_bees, 'nectar_count': nectar_count, 'width': size, 'length': size,
+            'max_steps': max_steps}
+
+
+def run_steps(cfg, seed, engine):
+    # Steps actually run: a colony can deplete its nectars before max_steps
+    env = build_environment(cfg, seed, engine, record='off')
+    steps = 0
+    while steps < cfg['max_steps'] and len(env.nectars) > 0:
+        env.update()
+        steps += 1
+    return steps
+
+
+def bench_update(num_bees, nectar_count, size, max_steps, engine='object', seed=0, repeat=3):
+    """Steps/second of Environment.update (best of repeat runs, same seed each time)
+    and the peak traced memory of one run, in MB."""
+    cfg = bench_config(num_bees, nectar_count, size, max_steps)
+    best = 0.0
+    for _ in range(repeat):
+        start = time.perf_counter()
+        steps = run_steps(cfg, seed, engine)
+        best = max(best, steps / (time.perf_counter() - start))
+    # Memory is traced in a separate run, since tracing slows the loop down
+    tracemalloc.start()
+    run_steps(cfg, seed, engine)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return {'steps': steps, 'steps_per_sec': best, 'peak_mb': peak / 2 ** 20}
+
+
+def bench_experiment(n_workers=2, seed=0):
+    """Runs/second of experiment.run_experiment in diagnostic mode, without the result cache."""
+    from experiment import run_experiment
+
+    with tempfile.TemporaryDirectory() as tmp, contextlib.redirect_stdout(io.StringIO()):
+        cwd = os.getcwd()
+        os.chdir(tmp)
+        try:
+            start = time.perf_counter()
+            df = run_experiment(diagnostic=True, n_workers=n_workers, seed=seed, cache=None)
+            elapsed = time.perf_counter() - start
+        finally:
+            os.chdir(cwd)
+    return {'runs': len(df), 'runs_per_sec': len(df) / elapsed}
+
+
+def bench_worker_startup(module, repeat=3):
+    """Seconds to import module (best of repeat fresh interpreters, as a spawned pool
+    worker would) and the peak memory of that interpreter, in MB."""
+    here = os.path.dirname(os.path.abspath(__file__))
+    best, peak = float('inf'), 0.0
+    for _ in range(repeat):
+        out = subprocess.run([sys.executable, '-c', STARTUP_SCRIPT.format(module=module)], capture_output=True,
+                             text=True, cwd=here, check=True).stdout.split()
+        best, peak = min(best, float(out[0])), max(peak, float(out[1]) / 2 ** 10)
+    return {'startup_sec': best, 'peak_mb': peak}
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def run_suite(grid=GRID, engines=('object', 'vector'), repeat=3, experiment=True, n_workers=2, seed=0):
+    results = []
+    cases = list(itertools.product(engines, *grid.values()))
+    for k, (engine, *values) in enumerate(cases):
+        params = {'engine': engine, **dict(zip(grid, values))}
+        print(f"[{k + 1}/{len(cases)}] update {params}", file=sys.stderr)
+        results.append({'name': 'update', 'params': params, **bench_update(*values, engine, seed, repeat)})
+    for module in ('experiment', 'testing'):
+        print(f"worker startup ({module})", file=sys.stderr)
+        results.append({'name': 'worker_startup', 'params': {'module': module},
+                        **bench_worker_startup(module, repeat)})
+    if experiment:
+        print("experiment (diagnostic)", file=sys.stderr)
+        results.append({'name': 'experiment_diagnostic', 'params': {'n_workers': n_workers},
+                        **bench_experiment(n_workers, seed)})
+    return {'commit': git_commit(), 'time': time.strftime('%Y-%m-%dT%H:%M:%S'), 'python': platform.python_version(),
+            'platform': platform.platform(), 'cpu_count': os.cpu_count(), 'seed': seed, 'results': results}
+
+
+def compare(old, new, threshold=0.1):
+    """Rows (name, params, metric, old, new, relative change, regressed) for the
+    cases present in both benchmark reports; a metric regresses when it is worse
+    by more than threshold."""
+    key = lambda r: (r['name'], json.dumps(r['params'], sort_keys=True))
+    before = {key(r): r for r in old['results']}
+    rows = []
+    for r in new['results']:
+        if key(r) not in before:
+            continue
+        for metric, higher in HIGHER_IS_BETTER.items():
+            if metric not in r or metric not in before[key(r)]:
+                continue
+            a, b = before[key(r)][metric], r[metric]
+            change = (b - a) / a if a else 0.0
+            regressed = change < -threshold if higher else change > threshold
+            rows.append((r['name'], r['params'], metric, a, b, change, regressed))
+    return rows
+
+
+if __name__ == "__main__":
+    # python benchmark.py run -o bench_<commit>.json [--quick]
+    # python benchmark.py compare bench_old.json bench_new.json [--threshold 0.1]
+    parser = argparse.ArgumentParser(description="Benchmarks for the simulation core and sweep drivers")
+    sub = parser.add_subparsers(dest='command', required=True)
+    run_parser = sub.add_parser('run', help="run the benchmarks and save them as JSON")
+    run_parser.add_argument('-o', '--output', help="JSON file (default: bench_<commit>.json)")
+    run_parser.add_argument('--quick', action='store_true', help="small grid, for a fast check")
+    run_parser.add_argument('--engine', nargs='+', default=['object', 'vector'], choices=['object', 'vector'])
+    run_parser.add_argument('--repeat', type=int, default=3)
+    run_parser.add_argument('--no-experiment', action='store_true', help="skip the run_experiment benchmark")
+    run_parser.add_argument('--workers', type=int, default=2)
+    compare_parser = sub.add_parser('compare', help="flag regressions between two saved runs")
+    compare_parser.add_argument('old')
+    compare_parser.add_argument('new')
+    compare_parser.add_argument('--threshold', type=float, default=0.1, help="relative change counted as a regression")
+    args = parser.parse_args()
+
+    if args.command == 'run':
+        report = run_suite(QUICK_GRID if args.quick else GRID, args.engine, args.repeat, not args.no_experiment,
+                           args.workers)
+        output = args.output or f"bench_{report['commit'] or 'local'}.json"
+        with open(output, 'w') as f:
+            json.dump(report, f, indent=1)
+        print(f"Saved benchmarks to {output}")
+    else:
+        with open(args.old) as f:
+            old = json.load(f)
+        with open(args.new) as f:
+            new = json.load(f)
+        rows = compare(old, new, args.threshold)
+        for name, params, metric, a, b, change, regressed in rows:
+            print(f"{'REGRESSION' if regressed else 'ok':10} {name} {params} {metric}: {a:.4g} -> {b:.4g} ({change:+.1%})")
+        n_regressed = sum(r[-1] for r in rows)
+        print(f"{n_regressed} regressions beyond {args.threshold:.0%} ({old['commit']} -> {new['commit']})")
+        sys.exit(1 if n_regressed else 0)
@@ -0,0 +1,114 @@
+import hashlib
+import json
+import numbers
+import os
+import sqlite3
+import time
+
+CACHE_PATH = 'results_cache.sqlite'
+
+# Sources whose behaviour determines a run's result, including the run() wrappers
+# in run.py and experiment.py whose output is cached. Any edit to them changes
+# engine_version() and so invalidates every cached result; bump ENGINE_VERSION to
+# invalidate by hand (e.g. after changing how a sweep turns a run into a result)
+ENGINE_FILES = ('classes.py', 'swarm.py', 'rng.py', 'dances.py', 'nectars.py', 'legs.py', 'spatial.py',
+                'history.py', 'run.py', 'experiment.py')
+ENGINE_VERSION = 1
+
+_engine_version = None
+
+
+def engine_version():
+    global _engine_version
+    if _engine_version is None:
+        h = hashlib.sha256(str(ENGINE_VERSION).encode())
+        here = os.path.dirname(os.path.abspath(__file__))
+        for name in ENGINE_FILES:
+            with open(os.path.join(here, name), 'rb') as f:
+                h.update(f.read())
+        _engine_version = h.hexdigest()[:16]
+    return _engine_version
+
+
+def plain(value):
+    # Numbers hash by value, so 10, 10.0 and np.float64(10) give the same key
+    if isinstance(value, numbers.Number) and not isinstance(value, bool):
+        return float(value)
+    return value
+
+
+def result_key(params, seed, engine='object', kind='run'):
+    """Hash of everything that determines a run's result: the full parameter dict,
+    the seed, the engine, which wrapper produced the result (kind) and the engine
+    version."""
+    blob = json.dumps({'params': {k: plain(v) for k, v in params.items()}, 'seed': int(seed),
+                       'engine': engine, 'kind': kind, 'version': engine_version()}, sort_keys=True)
+    return hashlib.sha256(blob.encode()).hexdigest()
+
+
+def params_key(params):
+    # Hash of a parameter dict alone, e.g. to tell apart queued tasks that share a seed
+    blob = json.dumps({k: plain(v) for k, v in params.items()}, sort_keys=True)
+    return hashlib.sha256(blob.encode()).hexdigest()[:16]
+
+
+class ResultCache:
+    """Run results stored in an SQLite file under result_key. Holds at most
+    max_entries results, evicting the least recently used; results from another
+    engine version can never be hit and are dropped when the cache is opened.
+
+    Each process should open its own ResultCache on the shared file."""
+
+    def __init__(self, path=CACHE_PATH, max_entries=200_000):
+        self.path = path
+        self.max_entries = max_entries
+        self.puts = 0
+        self.db = sqlite3.connect(path, timeout=60)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('CREATE TABLE IF NOT EXISTS results '
+                        '(key TEXT PRIMARY KEY, version TEXT, value TEXT, used REAL)')
+        self.db.execute('CREATE INDEX IF NOT EXISTS results_used ON results (used)')
+        with self.db:
+            self.db.execute('DELETE FROM results WHERE version != ?', (engine_version(),))
+
+    def get(self, key):
+        row = self.db.execute('SELECT value FROM results WHERE key = ?', (key,)).fetchone()
+        if row is None:
+            return None
+        with self.db:
+            self.db.execute('UPDATE results SET used = ? WHERE key = ?', (time.time(), key))
+        return json.loads(row[0])
+
+    def put(self, key, result):
+        with self.db:
+            self.db.execute('INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?)',
+                            (key, engine_version(), json.dumps(result, default=lambda v: v.item()), time.time()))
+        self.puts += 1
+        if self.puts % 100 == 0:
+            self.evict()
+
+    def evict(self):
+        (count,) = self.db.execute('SELECT COUNT(*) FROM results').fetchone()
+        if count > self.max_entries:
+            with self.db:
+                self.db.execute('DELETE FROM results WHERE key IN '
+                                '(SELECT key FROM results ORDER BY used LIMIT ?)', (count - self.max_entries,))
+
+    def cached(self, fn, params, seed, engine='object', kind='run'):
+        """fn() if its result is not cached yet, else the cached result."""
+        key = result_key(params, seed, engine, kind)
+        result = self.get(key)
+        if result is None:
+            result = fn()
+            self.put(key, result)
+        return result
+
+    def clear(self):
+        with self.db:
+            self.db.execute('DELETE FROM results')
+
+    def __len__(self):
+        return self.db.execute('SELECT COUNT(*) FROM results').fetchone()[0]
+
+    def close(self):
+        self.db.close()
@@ -0,0 +1,83 @@
+import csv
+import os
+
+import pandas as pd
+
+import store
+
+
+def task_key(record, fields):
+    # Numbers are compared as floats so keys read back from the CSV match fresh ones;
+    # a field the record lacks (e.g. one added to the key since it was written) is None
+    key = []
+    for field in fields:
+        value = record.get(field)
+        try:
+            key.append(repr(float(value)))
+        except (TypeError, ValueError):
+            key.append(str(value))
+    return tuple(key)
+
+
+class Checkpoint:
+    """Finished records of a sweep, appended to a .partial CSV next to the final output
+    in batches of batch_size. Each record is keyed by key_fields; opening a checkpoint
+    on an existing .partial file loads its records, so a rerun of the same sweep can
+    skip every task already in `done`. Use as a context manager so buffered records
+    are written even if the sweep is interrupted."""
+
+    def __init__(self, outfile, key_fields, batch_size=50):
+        self.path = outfile + '.partial'
+        self.key_fields = tuple(key_fields)
+        self.batch_size = batch_size
+        self.pending = []
+        self.fieldnames = None
+        if os.path.exists(self.path) and os.path.getsize(self.path) > 0:
+            existing = pd.read_csv(self.path, float_precision='round_trip')
+            self.fieldnames = list(existing.columns)
+            self.records = [{k: (None if pd.isna(v) else v) for k, v in r.items()}
+                            for r in existing.to_dict('records')]
+        else:
+            self.records = []
+        self.done = {self.key(r) for r in self.records}
+
+    def key(self, record):
+        return task_key(record, self.key_fields)
+
+    def add(self, record):
+        self.records.append(record)
+        self.done.add(self.key(record))
+        self.pending.append(record)
+        if len(self.pending) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if not self.pending:
+            return
+        new_file = self.fieldnames is None
+        if new_file:
+            self.fieldnames = list(self.pending[0])
+        with open(self.path, 'a', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=self.fieldnames)
+            if new_file:
+                writer.writeheader()
+            writer.writerows(self.pending)
+            f.flush()
+            os.fsync(f.fileno())
+        self.pending = []
+
+    def finish(self, df, columns=None):
+        """Write the final output from df (restricted to columns, if given; see
+        store.write_table) and drop the .partial file."""
+        self.flush()
+        outfile = self.path[:-len('.partial')]
+        store.write_table(df if columns is None else df[columns], outfile)
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.flush()
+        return False
@@ -1,138 +1,177 @@
+import heapq
+import math
+
 import numpy as np
-import matplotlib
-matplotlib.use('TkAgg')
-import matplotlib.pyplot as plt
-import matplotlib.patches as patches
-import matplotlib.animation as animation
+
+from spatial import NectarGrid
+from rng import RandomStream
+from dances import DanceBoard
+from nectars import NectarTable
+from legs import following_steps, returning_steps
+from history import History, TrajectoryWriter, Trajectory
+
+STATES = ('home', 'searching', 'following', 'found', 'returning', 'dancing')
+STATE_CODES = {state: code for code, state in enumerate(STATES)}
 
 
 class Environment:
     def __init__(self, width, length, hive_radius, nectar_count, max_nec_strength, idle_prob, follow_prob,
-                 max_st, hive_pos, seed=None):
+                 max_st, hive_pos, seed=None, record='all', record_n=None, record_path=None):
         self.width = width
         self.length = length
         self.hive_radius = hive_radius
         self.max_nec_strength = max_nec_strength
         self.idle_prob = idle_prob
         self.follow_prob = follow_prob
-        self.nectars = self.place_nectar(nectar_count, max_st, seed)
+        # Every random draw of this environment and its bees comes from this stream
+        self.rng = RandomStream(seed)
+        self.nectar_table = self.place_nectar(nectar_count, max_st)
+        self.nectars = NectarTable(self.nectar_table)
         self.hive_position = self.place_hive(hive_pos)
+        self.nectar_grid = None
         self.bees = []
-        self.dances = []
-        self.history = []
-
-    def place_nectar(self, num, max_st, seed):
-        if seed is not None:
-            rng = np.random.default_rng(seed)
+        self.dances = DanceBoard()
+        self.t = 0
+        # Bees are updated only from their wake step on: awake holds the indices of bees
+        # due every step, wakeups a heap of (wake step, index) for the others and idle
+        # the bees waiting in the hive, whose wait depends on whether there are dances
+        self.awake = set()
+        self.wakeups = []
+        self.idle = set()
+        self._ready = None
+        self._cursor = -1
+        nectar_positions = [n['position'] for n in self.nectar_table]
+        if record_path is not None:
+            # Frames go straight to disk and can be replayed later with from_trajectory
+            self.history = TrajectoryWriter(record_path, nectar_positions, record, record_n,
+                                            meta=self.trajectory_meta())
         else:
-            rng = np.random.default_rng()
+            self.history = History(nectar_positions, record, record_n)
+
+    def trajectory_meta(self):
+        return {'width': self.width, 'length': self.length, 'hive_position': list(self.hive_position),
+                'hive_radius': self.hive_radius, 'max_nec_strength': self.max_nec_strength, 'states': STATES}
+
+    @classmethod
+    def from_trajectory(cls, path):
+        # Replay-only environment for visualise/plot_grid on a run recorded with record_path
+        env = cls.__new__(cls)
+        env.history = Trajectory(path)
+        meta = env.history.meta
+        env.width, env.length = meta['width'], meta['length']
+        env.hive_position = tuple(meta['hive_position'])
+        env.hive_radius = meta['hive_radius']
+        env.max_nec_strength = meta['max_nec_strength']
+        env.nectars, env.bees, env.dances = NectarTable([]), [], DanceBoard()
+        return env
+
+    def place_nectar(self, num, max_st):
+        xs = self.rng.uniform(0, self.length, size=num).tolist()
+        ys = self.rng.uniform(0, self.width, size=num).tolist()
+        strengths = ([self.max_nec_strength] * num if max_st
+                     else self.rng.integers(1, self.max_nec_strength + 1, size=num).tolist())
+        # A nectar's id is its index in nectar_table and stays fixed for the whole run
         nectars = []
-        for n in range(num):
-            x = np.random.uniform(0, self.length)
-            y = np.random.uniform(0, self.width)
-            stren = (self.max_nec_strength if max_st else np.random.randint(1, self.max_nec_strength + 1))
-            nectars.append({'position': (x, y), 'strength': stren})
+        for nid, (x, y, stren) in enumerate(zip(xs, ys, strengths)):
+            nectars.append({'id': nid, 'position': (x, y), 'strength': stren})
         return nectars
 
     def place_hive(self, hive_pos):
         if hive_pos == 'centre':
             return self.length/2, self.width/2
         elif hive_pos == 'random':
-            return np.random.uniform(0, self.length), np.random.uniform(0, self.width)
+            return self.rng.uniform(0, self.length), self.rng.uniform(0, self.width)
         else:
             ValueError(f'Not valid hive position: {hive_pos} should be "centre" or "random"')
 
     def add_bee(self, bee):
+        bee.index = len(self.bees)
         self.bees.append(bee)
+        self.awake.add(bee.index)
 
     def add_dance(self, direction, distance, strength):
-        self.dances.append({'direction': direction, 'distance': distance, 'strength': strength})
+        added = self.dances.add(direction, distance, strength)
+        if added and len(self.dances) == 1:
+            self.wake_idle()
+        return added
+
+    def remove_dance(self, direction, distance):
+        removed = self.dances.remove(direction, distance)
+        if removed and not self.dances:
+            self.wake_idle()
+        return removed
+
+    def wake_idle(self):
+        # Idle bees leave at a rate that depends on whether any dance is on; when that
+        # changes they all redraw their wait, from this step if their turn is still to come
+        for bee in self.idle:
+            bee.departing = False
+            if bee.wake <= self.t:
+                # Already due this step and not updated yet
+                continue
+            bee.wake = self.t
+            self.awake.add(bee.index)
+            if self._ready is not None and bee.index > self._cursor:
+                heapq.heappush(self._ready, bee.index)
+        self.idle.clear()
+
+    def nectars_near(self, position, radius):
+        # The grid is built on first use, with cells sized to the first sense range asked for
+        if self.nectar_grid is None:
+            self.nectar_grid = NectarGrid(radius, self.nectars)
+        return self.nectar_grid.near(position, radius)
 
     def update(self):
-        for b in self.bees:
+        # Bees on a straight leg or waiting in the hive skip their updates until their
+        # wake step; the rest are updated in the order they were added
+        while self.wakeups and self.wakeups[0][0] <= self.t:
+            wake, i = heapq.heappop(self.wakeups)
+            if self.bees[i].wake == wake:
+                self.awake.add(i)
+        self._ready = sorted(self.awake)
+        while self._ready:
+            i = self._cursor = heapq.heappop(self._ready)
+            b = self.bees[i]
+            if b.leg is not None:
+                b.land()
             b.update()
-        self.nectars = [n for n in self.nectars if n['strength'] > 0]
+            if b.wake > self.t:
+                self.awake.discard(i)
+                heapq.heappush(self.wakeups, (b.wake, i))
+        self._ready = None
+        self._cursor = -1
+        for n in self.nectars.deplete():
+            if self.nectar_grid is not None:
+                self.nectar_grid.remove(n)
+        self.t += 1
         self.record_state()
 
-    def record_state(self):
-        bee_data = [{'position': bee.position, 'state': bee.state} for bee in self.bees]
-        nectar_data = [{'position': nectar['position'], 'strength': nectar['strength']} for nectar in self.nectars]
-        self.history.append({'bee_data': bee_data, 'nectar_data': nectar_data})
-
-    def visualise(self, fps=30, filename=None):
-        fig, ax = plt.subplots(1, 1)
-        ax.set_xlim(0, self.length)
-        ax.set_ylim(0, self.width)
-
-        title = ax.set_title(f'Bee swarm foraging')
-
-        bee_scat = ax.scatter([], [], color='black', s=50)
-        nectar_scat = ax.scatter([], [], color='orange', marker='*', s=100, alpha=0.0)
-        hive_circle = patches.Circle(self.hive_position, radius=self.hive_radius,
-                                     facecolor='gold', edgecolor='black', label='Hive')
-        ax.add_patch(hive_circle)
-
-        def init():
-            bee_scat.set_offsets(np.empty((0, 2)))
-            nectar_scat.set_offsets(np.empty((0, 2)))
-            nectar_scat.set_alpha(0)
-            return [bee_scat, nectar_scat, hive_circle, title]
-
-        def update(frame):
-            bee_positions = [b['position'] for b in self.history[frame]['bee_data']]
-            bee_states = [b['state'] for b in self.history[frame]['bee_data']]
-            bee_scat.set_offsets(np.array(bee_positions))
-
-            nectar_positions = []
-            nectar_alphas = []
-            for nec in self.history[frame]['nectar_data']:
-                nectar_positions.append(nec['position'])
-                strength = nec['strength']
-                nectar_alphas.append(np.clip(strength / self.max_nec_strength, 0, 1))
-
-            if nectar_positions:
-                nectar_scat.set_offsets(np.array(nectar_positions))
-                nectar_scat.set_alpha(nectar_alphas)
-            else:
-                # safely reset to empty without touching alpha
-                nectar_scat.set_offsets(np.empty((0, 2)))
-
-            bees_in_hive = sum(np.linalg.norm(np.array(pos) - np.array(self.hive_position)) <= self.hive_radius
-                               for pos in bee_positions)
-
-            # Update the title
-            title.set_text(f"Bee swarm foraging - Bees in hive: {bees_in_hive}")
-
-            return [bee_scat, nectar_scat, title]
-
-        ani = animation.FuncAnimation(fig, update, init_func=init, frames=len(self.history), interval=1000/fps, blit=False)
+    def bee_snapshot(self):
+        return (np.array([bee.position_at(self.t) for bee in self.bees]).reshape(-1, 2),
+                np.array([STATE_CODES[bee.state] for bee in self.bees], dtype=np.int8))
 
-        if filename:
-            ani.save(filename)
+    def nectar_strengths(self):
+        return np.array([n['strength'] for n in self.nectar_table], dtype=float)
 
-        plt.show()
-
-    def plot_grid(self, step):
-        fig, ax = plt.subplots(1, 1)
-        ax.set_title(f'Bee swarm - step {step}' if step is not None else 'Bee swarm')
-        ax.set_xlim(0, self.length)
-        ax.set_ylim(0, self.width)
+    def record_state(self):
+        if self.history.recording(self.t):
+            positions, states = self.bee_snapshot()
+            self.history.append(self.t, positions, states, self.nectar_strengths())
 
-        for nec in self.nectars:
-            x, y = nec['position']
-            s = nec['strength']
-            alph = s / self.max_nec_strength
-            ax.scatter(x, y, color='orange', s=100, alpha=alph, marker='*', label='Nectar')
+    def _replay_source(self, source):
+        if source is None:
+            return self.history.reader()
+        return Trajectory(source) if isinstance(source, str) else source
 
-        hive_circle = patches.Circle(self.hive_position, radius=self.hive_radius,
-                                     facecolor='gold', edgecolor='black', label='Hive')
-        ax.add_patch(hive_circle)
+    def visualise(self, fps=30, filename=None, source=None, **options):
+        # Rendering lives in render.py, so the simulation never imports matplotlib;
+        # options (every, max_frames, max_bees, n_jobs) are those of render.visualise
+        from render import visualise
+        return visualise(self, fps, filename, source, **options)
 
-        for bee in self.bees:
-            if bee.state not in ['home', 'dancing']:
-                bx, by = bee.position
-                ax.scatter(bx, by, color='black', s=50)
-        plt.show()
+    def plot_grid(self, step, frame=None, source=None):
+        from render import plot_grid
+        plot_grid(self, step, frame, source)
 
 
 class Bee:
@@ -149,19 +188,72 @@ class Bee:
         self.position = self.env.hive_position
         self.state = "home"
         self.dance = 0
+        # Ids into env.nectar_table
         self.found_nectar = []
-        self.known_nectars = []
+        self.known_nectars = set()
         self.path_history = [self.position]
         self.target = None
+        # (first skipped step, position at that step, move per step) while on a leg
+        self.leg = None
+        self.wake = 0
+        # Set while the bee waits in the hive for a departure already drawn
+        self.departing = False
+        self.index = None
+
+    def position_at(self, step):
+        if self.leg is None:
+            return self.position
+        start, origin, move = self.leg
+        return tuple(origin + (step - start) * move)
+
+    def sleep(self, steps, move):
+        # Skip the next steps updates, each of which would only have moved the bee by
+        # about move; position_at() extrapolates along it in the meantime
+        if steps > 0:
+            self.leg = (self.env.t + 1, np.array(self.position, dtype=float), np.asarray(move, dtype=float))
+            self.wake = self.env.t + 1 + steps
+
+    def land(self):
+        # Replay the skipped moves with the same float arithmetic as update(), so a
+        # bee that slept ends up exactly where one stepped every update would be
+        start, origin, move = self.leg
+        x, y = self.position
+        if self.state == "returning":
+            hx, hy = self.env.hive_position
+            for _ in range(self.wake - start):
+                x, y = self._toward_hive(x, y, hx, hy)
+                self.path_history.append((x, y))
+        else:
+            dx, dy = self.dt * self.target["direction"][0], self.dt * self.target["direction"][1]
+            for _ in range(self.wake - start):
+                x, y = x + dx, y + dy
+                self.path_history.append((x, y))
+        self.position = (x, y)
+        self.leg = None
+
+    def _toward_hive(self, x, y, hx, hy):
+        dist = math.dist((x, y), (hx, hy))
+        return x + self.dt * (hx - x) / dist, y + self.dt * (hy - y) / dist
+
+    def plan_following(self):
+        # The leg along target['direction'] stays a plain move until a new nectar comes
+        # into sense range, the bee gets far enough from the hive, or it hits the edge
+        nectars = self.env.nectars
+        candidates = nectars.active.copy()
+        candidates[list(self.known_nectars)] = False
+        move = (self.dt * self.target["direction"][0], self.dt * self.target["direction"][1])
+        self.sleep(following_steps(self.position, move, self.env.hive_position,
+                                   self.target["distance"] - self.sense_range, nectars.positions[candidates],
+                                   self.sense_range, (self.env.width, self.env.length)), move)
 
     def sense_nectar(self):
         new_nectar = []
-        for nec in self.env.nectars:
+        for nec in self.env.nectars_near(self.position, self.sense_range):
             dist = np.linalg.norm(np.array(nec['position']) - np.array(self.position))
             if dist <= self.sense_range:
-                if nec not in self.known_nectars:
-                    self.known_nectars.append(nec)
-                    new_nectar.append(nec)
+                if nec['id'] not in self.known_nectars:
+                    self.known_nectars.add(nec['id'])
+                    new_nectar.append(nec['id'])
         self.found_nectar = new_nectar
 
     def move(self, random=False):
@@ -192,11 +284,13 @@ class Bee:
             if np.linalg.norm(combined_vec) > 0:
                 combined_vec = combined_vec / np.linalg.norm(combined_vec)
                 pref_angle = np.arctan2(combined_vec[1], combined_vec[0])
+                distance_from_hive = np.linalg.norm(np.array(self.position) - np.array(self.env.hive_position))
+                kappa = self.kappa_0 + self.alpha * np.exp(-distance_from_hive / self.beta)
+                angle = self.env.rng.vonmises(pref_angle, kappa)
             else:
-                pref_angle = np.random.uniform(0, 2 * np.pi)
-            distance_from_hive = np.linalg.norm(np.array(self.position) - np.array(self.env.hive_position))
-            kappa = self.kappa_0 + self.alpha * np.exp(-distance_from_hive / self.beta)
-            angle = np.random.vonmises(mu=pref_angle, kappa=kappa)
+                # Von Mises noise around a uniformly random preferred angle is itself
+                # uniform, so a single buffered draw replaces both
+                angle = self.env.rng.uniform(0, 2 * np.pi)
             dx, dy = self.dt * np.cos(angle), self.dt * np.sin(angle)
         elif self.target:
             dx, dy = self.dt * self.target["direction"][0], self.dt * self.target["direction"][1]
@@ -221,14 +315,16 @@ class Bee:
                     self.target = None
                 else:
                     self.move()
+                    self.plan_following()
             elif self.env.dances:
-                self.target = np.random.choice(self.env.dances)
+                self.target = self.env.rng.choice(self.env.dances)
                 self.sense_nectar()
                 if self.found_nectar:
                     self.state = "found"
                     self.target = None
                 else:
                     self.move()
+                    self.plan_following()
             else:
                 self.state = ("searching" if self.scout else "returning")
                 self.target = None
@@ -240,35 +336,46 @@ class Bee:
             elif dist_to_hive <= self.env.hive_radius:
                 if self.env.dances:
                     self.state = "following"
-                    self.target = np.random.choice(self.env.dances)
+                    self.target = self.env.rng.choice(self.env.dances)
                 else:
                     self.move(random=True)
             else:
                 self.move(random=True)
         elif self.state == "home":
             if self.known_nectars:
-                nec = np.random.choice(self.known_nectars)
+                nec = self.env.nectar_table[self.env.rng.choice(sorted(self.known_nectars))]
                 vector = np.array(nec['position']) - np.array(self.position)
                 distance = np.linalg.norm(vector)
                 direction = tuple(vector / distance)
                 self.known_nectars.clear()
-                exists = any(np.allclose(d["direction"], direction) and np.isclose(d["distance"], distance)
-                             for d in self.env.dances)
-                if not exists:
-                    strength = nec["strength"]
-                    self.env.add_dance(direction, distance, strength)
+                strength = nec["strength"]
+                if self.env.add_dance(direction, distance, strength):
                     self.state = "dancing"
                     self.target = {'direction': direction, 'distance': distance, 'strength': strength}
                     self.dance = 1
             elif self.target:
                 self.state = "following"
             else:
-                if self.scout and np.random.rand() > self.env.idle_prob:
+                # Scouts leave to search with probability 1 - idle_prob per step and any
+                # bee staying follows a dance, if there is one, with probability follow_prob.
+                # The wait until the bee leaves is therefore geometric, and is drawn once
+                p_search = 1 - self.env.idle_prob if self.scout else 0
+                p_follow = (1 - p_search) * self.env.follow_prob if self.env.dances else 0
+                if not self.departing:
+                    p = p_search + p_follow
+                    wait = self.env.rng.geometric(p) - 1 if p > 0 else math.inf
+                    if wait > 0:
+                        self.departing = True
+                        self.wake = self.env.t + wait
+                        self.env.idle.add(self)
+                        return
+                self.departing = False
+                self.env.idle.discard(self)
+                if self.env.rng.random() * (p_search + p_follow) < p_search:
                     self.state = "searching"
                 else:
-                    if self.env.dances and np.random.rand() < self.env.follow_prob:
-                        self.state = "following"
-                        self.target = np.random.choice(self.env.dances)
+                    self.state = "following"
+                    self.target = self.env.rng.choice(self.env.dances)
 
                 # self.state = np.random.choice(["home", "following", "searching"],
                 #                                   p=[self.env.idle_prob, self.env.follow_prob,
@@ -278,21 +385,21 @@ class Bee:
                 # elif self.state == "following":
                 #     if not self.target:
                 #         if self.env.dances:
-                #             self.target = np.random.choice(self.env.dances)
+                #             self.target = self.env.rng.choice(self.env.dances)
                 #         else:
                 #             self.state = "searching"
         elif self.state == "found":
-            nec = None
-            for n in self.found_nectar:
-                vector = np.array(n['position']) - np.array(self.position)
-                distance = np.linalg.norm(vector)
-                direction = vector / distance
-                if self.target and np.allclose(direction, self.target["direction"]):
-                    nec = n
-                    break
-            if nec is None:
-                nec = np.random.choice(self.found_nectar)
-            nec['strength'] -= 1
+            nid = None
+            if self.target:
+                for n in self.found_nectar:
+                    vector = np.array(self.env.nectar_table[n]['position']) - np.array(self.position)
+                    direction = vector / np.linalg.norm(vector)
+                    if np.allclose(direction, self.target["direction"]):
+                        nid = n
+                        break
+            if nid is None:
+                nid = self.env.rng.choice(self.found_nectar)
+            self.env.nectars.take(nid)
             dist_to_hive = np.linalg.norm(np.array(self.position) - np.array(self.env.hive_position))
             if dist_to_hive <= self.env.hive_radius:
                 self.state = "home"
@@ -304,24 +411,21 @@ class Bee:
             # if self.path_history:
             #     self.position = (self.path_history[-1][0], self.path_history[-1][1])
             #     self.path_history.pop()
-            vec_to_home = np.array(self.env.hive_position) - np.array(self.position)
-            dist_to_hive = np.linalg.norm(vec_to_home)
+            dist_to_hive = math.dist(self.position, self.env.hive_position)
             if dist_to_hive <= self.env.hive_radius:
                 self.state = "home"
                 self.position = self.env.hive_position
                 self.path_history.clear()
             else:
-                vec_to_home = tuple(vec_to_home / dist_to_hive)
-                self.position = (self.position[0] + self.dt * vec_to_home[0], self.position[1] + self.dt * vec_to_home[1])
+                self.position = self._toward_hive(*self.position, *self.env.hive_position)
                 self.path_history.append(self.position)
+                steps = returning_steps(self.position, self.env.hive_position, self.env.hive_radius, self.dt)
+                if steps:
+                    vec_to_home = np.array(self.env.hive_position) - np.array(self.position)
+                    self.sleep(steps, self.dt * vec_to_home / np.linalg.norm(vec_to_home))
         elif self.state == "dancing":
             if self.dance > self.target['strength']:
-                if self.env.dances:
-                    for dance in self.env.dances:
-                        if (np.allclose(dance["direction"], self.target["direction"]) and
-                                np.isclose(dance["distance"], self.target["distance"])):
-                            self.env.dances.remove(dance)
-                            # self.target = None
+                self.env.remove_dance(self.target["direction"], self.target["distance"])
                 self.state = "home"
                 self.dance = 0
                 # if self.target:
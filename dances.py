@@ -0,0 +1,69 @@
+DANCE_RESOLUTION = 1e-6
+
+
+def dance_key(direction, distance, resolution=DANCE_RESOLUTION):
+    """Quantized (direction, distance) used to tell whether two dances advertise the
+    same nectar. Recruits dance from the hive position, so repeat dances for one
+    nectar agree to far better than the resolution."""
+    return (round(float(direction[0]) / resolution), round(float(direction[1]) / resolution),
+            round(float(distance) / resolution))
+
+
+class DanceBoard:
+    """Live dances of an environment, keyed by dance_key. Dances are also kept in a
+    dense list so a uniform choice is a single index draw; removal swaps the last
+    dance into the freed slot, so add, lookup, remove and sampling are all O(1).
+
+    Behaves as a sequence of dance dicts: len(), truthiness, iteration, indexing and
+    rng.choice(board) work as they did on the old list of dances."""
+
+    def __init__(self, dances=(), resolution=DANCE_RESOLUTION):
+        self.resolution = resolution
+        self.slots = {}
+        self.entries = []
+        self.keys = []
+        for d in dances:
+            self.add(d['direction'], d['distance'], d['strength'])
+
+    def key(self, direction, distance):
+        return dance_key(direction, distance, self.resolution)
+
+    def add(self, direction, distance, strength):
+        """Add a dance unless one for the same (direction, distance) is live; returns
+        whether it was added."""
+        key = self.key(direction, distance)
+        if key in self.slots:
+            return False
+        self.slots[key] = len(self.entries)
+        self.entries.append({'direction': direction, 'distance': distance, 'strength': strength})
+        self.keys.append(key)
+        return True
+
+    def find(self, direction, distance):
+        slot = self.slots.get(self.key(direction, distance))
+        return None if slot is None else self.entries[slot]
+
+    def remove(self, direction, distance):
+        slot = self.slots.pop(self.key(direction, distance), None)
+        if slot is None:
+            return False
+        last_entry, last_key = self.entries.pop(), self.keys.pop()
+        if slot < len(self.entries):
+            self.entries[slot] = last_entry
+            self.keys[slot] = last_key
+            self.slots[last_key] = slot
+        return True
+
+    def clear(self):
+        self.slots.clear()
+        self.entries.clear()
+        self.keys.clear()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __iter__(self):
+        return iter(self.entries)
+
+    def __getitem__(self, i):
+        return self.entries[i]
@@ -1,27 +1,30 @@
 import numpy as np
 import pandas as pd
-from scipy.stats import qmc
+from scipy.stats import qmc, norm, t as student_t
 import random
 from classes import *  # assumes your Environment and Bee live here
+from run import build_environment, check_ensemble, run_ensemble
+from checkpoint import Checkpoint
+from cache import ResultCache, CACHE_PATH, params_key
+from jobqueue import JobQueue, work
+from instrument import Profiler, ProfileAggregator
+from aggregate import SweepSummary
+import store
 from tqdm import tqdm
-from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures import ProcessPoolExecutor, as_completed, wait, FIRST_COMPLETED
 import multiprocessing
+import csv
+import itertools
+import os
+import time
 
 # ---------------------------
 # Simulator wrapper
 # ---------------------------
-def run(inpt, vis=False, max_steps=False, seed=None):
-    env = Environment(
-        inpt['width'], inpt['length'], inpt['hive_radius'], inpt['nectar_count'],
-        inpt['max_nec_strength'], inpt['idle_prob'], inpt['follow_prob'],
-        max_st=True, hive_pos='centre', seed=seed
-    )
-    num_scouts = int(inpt['num_bees'] * inpt['perc_scouts'])
-    for i in range(inpt['num_bees']):
-        sc = i < num_scouts
-        b = Bee(env, inpt['sense_range'], inpt['dt'], inpt['kappa_0'], inpt['alpha'],
-                inpt['beta'], inpt['w_dir'], scout=sc)
-        env.add_bee(b)
+def run(inpt, vis=False, max_steps=False, seed=None, engine='object', record=None, record_n=None, profile=False):
+    record = record or ('all' if vis else 'off')
+    env = build_environment(inpt, seed, engine, record, record_n)
+    profiler = Profiler().attach(env) if profile else None
 
     total = sum([nec['strength'] for nec in env.nectars])
     t = 0
@@ -43,11 +46,14 @@ def run(inpt, vis=False, max_steps=False, seed=None):
     if vis:
         env.visualise()
 
-    return {
+    result = {
         'time_to_depletion': time,
         'time_to_first_nectar': time_first_nect,
         'success': success
     }
+    if profiler is not None:
+        result['profile'] = profiler.result()
+    return result
 
 # ---------------------------
 # Experiment setup
@@ -65,62 +71,245 @@ param_bounds = {'idle_prob': (0.0, 0.5), 'follow_prob': (0.4, 0.99), 'perc_scout
 # ---------------------------
 # LHS sampling
 # ---------------------------
-def latin_hypercube_samples(n_samples, param_bounds):
-    sampler = qmc.LatinHypercube(d=len(param_bounds))
+def latin_hypercube_samples(n_samples, param_bounds, seed=None):
+    sampler = qmc.LatinHypercube(d=len(param_bounds), seed=seed)
     sample = sampler.random(n=n_samples)
     l_bounds = [param_bounds[p][0] for p in param_bounds]
     u_bounds = [param_bounds[p][1] for p in param_bounds]
     scaled = qmc.scale(sample, l_bounds, u_bounds)
     return [dict(zip(param_bounds.keys(), row)) for row in scaled]
 
+
+def sample_configs(psets):
+    # Full run configs of a design: base_config with each sampled parameter set applied
+    return [{**base_config, **pset} for pset in psets]
+
 # ---------------------------
 # Worker for parallel execution
 # ---------------------------
-def run_single(config, sample_id, rep):
-    seed = random.randint(0, 1_000_000)
-    result = run(config, vis=False, seed=seed, max_steps=config['max_steps'])
+RECORD_COLUMNS = ['sample_id', 'rep', *param_bounds, 'time_to_depletion', 'time_to_first_nectar', 'success']
+# A task is identified by these; the seed column only lives in the .partial checkpoint
+TASK_KEY = ('sample_id', 'rep', 'seed', *param_bounds)
+
+
+def task_seed(seed, sample_id, rep):
+    # Deterministic per-task seed, so a rerun of a sweep recreates the same tasks
+    if seed is None:
+        return random.randint(0, 1_000_000)
+    return int(np.random.SeedSequence([seed, sample_id, rep]).generate_state(1)[0])
+
+
+def make_record(config, sample_id, rep, result, seed=None):
     return {
         'sample_id': sample_id,
         'rep': rep,
         **{k: config[k] for k in param_bounds.keys()},
         'time_to_depletion': result['time_to_depletion'],
         'time_to_first_nectar': result['time_to_first_nectar'],
-        'success': result['success']
+        'success': result['success'],
+        'seed': seed
     }
 
+
+def run_single(config, sample_id, rep, engine='object', seed=None, cache=None, profile=False):
+    # With a ResultCache, a run already simulated with the same config and seed is not repeated.
+    # Profiled runs always simulate, and their record carries the run's 'profile'
+    seed = random.randint(0, 1_000_000) if seed is None else seed
+    simulate = lambda: run(config, vis=False, seed=seed, max_steps=config['max_steps'], engine=engine,
+                           profile=profile)
+    result = simulate() if cache is None or profile else cache.cached(simulate, config, seed, engine, kind='experiment')
+    record = make_record(config, sample_id, rep, result, seed)
+    if profile:
+        record['profile'] = result['profile']
+    return record
+
+
+def run_batch(tasks, batch_size=None):
+    # Ensemble counterpart of run_single: the (config, sample_id, rep, seed) tasks advance
+    # together, batch_size of them at a time (see run.run_ensemble)
+    results = run_ensemble([cfg for cfg, _, _, _ in tasks], max_steps=True, seeds=[s for *_, s in tasks],
+                           batch_size=batch_size)
+    return [make_record(cfg, i, rep, result, s) for (cfg, i, rep, s), result in zip(tasks, results)]
+
+# ---------------------------
+# Sequential stopping
+# ---------------------------
+def ttd_ci_width(times, confidence=0.95):
+    # Width of the t confidence interval on mean time_to_depletion, relative to the mean
+    times = np.asarray([t for t in times if t is not None and not pd.isna(t)], dtype=float)
+    if len(times) < 2:
+        return np.inf
+    half = student_t.ppf(0.5 + confidence / 2, len(times) - 1) * times.std(ddof=1) / np.sqrt(len(times))
+    return 2 * half / times.mean()
+
+
+def success_ci_width(successes, confidence=0.95):
+    # Width of the Wilson score interval on the success rate
+    n = len(successes)
+    if n == 0:
+        return np.inf
+    z = norm.ppf(0.5 + confidence / 2)
+    p = np.mean(successes)
+    return 2 * z * np.sqrt(p * (1 - p) / n + z ** 2 / (4 * n ** 2)) / (1 + z ** 2 / n)
+
+
+def sample_resolved(records, ttd_width=0.3, success_width=0.3):
+    # A sample stops once either its mean time_to_depletion or its success rate is pinned down
+    return (ttd_ci_width([r['time_to_depletion'] for r in records]) <= ttd_width or
+            success_ci_width([r['success'] for r in records]) <= success_width)
+
+
+def sample_records(records, target):
+    # Records of each sample, restricted to the replicates currently wanted
+    by_sample = [[] for _ in target]
+    for rec in records:
+        i, rep = int(rec['sample_id']), int(rec['rep'])
+        if i < len(target) and rep < target[i]:
+            by_sample[i].append(rec)
+    return by_sample
+
+
+def sweep_records(checkpoint, keys):
+    # Checkpointed records of the tasks keyed in keys, without those of other sweeps
+    return [rec for rec in checkpoint.records if checkpoint.key(rec) in keys]
+
 # ---------------------------
 # Run experiment with multiprocessing + tqdm
 # ---------------------------
-def run_experiment(n_samples=20, n_reps=5, outfile="results.csv", n_workers=None, diagnostic=False):
+# Configs of the running sweep, loaded once per worker process by init_worker so
+# that tasks only carry (sample_id, rep, seed), and the worker's result cache
+_worker_configs = None
+_worker_cache = None
+
+
+def init_worker(configs, cache_path=None):
+    global _worker_configs, _worker_cache
+    _worker_configs = configs
+    _worker_cache = ResultCache(cache_path) if cache_path else None
+
+
+def run_chunk(chunk, engine='object', ensemble=None, profile=False):
+    # Runs a chunk of (sample_id, rep, seed) tasks in one worker; ensembles are not profiled
+    check_ensemble(engine, ensemble)
+    if ensemble:
+        # `ensemble` runs are simulated together, each finished one replaced by the next of the chunk
+        return run_batch([(_worker_configs[i], i, rep, s) for i, rep, s in chunk], ensemble)
+    return [run_single(_worker_configs[i], i, rep, engine, s, _worker_cache, profile) for i, rep, s in chunk]
+
+
+def run_config_chunk(chunk, engine='object'):
+    # Like run_chunk, for tasks that carry their own config: (config, sample_id, rep, seed)
+    return [run_single(cfg, i, rep, engine, s, _worker_cache) for cfg, i, rep, s in chunk]
+
+
+def chunk_size(n_tasks, n_workers, ensemble=None):
+    # About four chunks per worker: IPC scales with chunks rather than runs, while
+    # the last chunks are still small enough not to leave workers idle at the tail
+    size = max(1, -(-n_tasks // (4 * n_workers)))
+    return ensemble * max(1, size // ensemble) if ensemble else size
+
+
+def run_tasks(executor, tasks, engine='object', ensemble=None, chunksize=1, profile=False):
+    # Yields records as their chunks complete
+    check_ensemble(engine, ensemble)
+    futures = [executor.submit(run_chunk, tasks[b:b + chunksize], engine, ensemble, profile)
+               for b in range(0, len(tasks), chunksize)]
+    for f in as_completed(futures):
+        yield from f.result()
+
+
+def stream_tasks(executor, tasks, engine='object', ensemble=None, chunksize=1, max_pending=8):
+    # Like run_tasks for any iterable of tasks, with at most max_pending chunks in
+    # flight, so neither the task list nor the finished records pile up in the driver
+    check_ensemble(engine, ensemble)
+    tasks = iter(tasks)
+    pending = set()
+    while True:
+        while len(pending) < max_pending:
+            chunk = list(itertools.islice(tasks, chunksize))
+            if not chunk:
+                break
+            pending.add(executor.submit(run_chunk, chunk, engine, ensemble))
+        if not pending:
+            return
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        for f in done:
+            yield from f.result()
+
+
+def run_experiment(n_samples=20, n_reps=5, outfile="results.csv", n_workers=None, diagnostic=False,
+                   engine='object', ensemble=None, adaptive=False, wave=5, max_reps=50, ttd_width=0.3,
+                   success_width=0.3, seed=0, batch_size=50, chunksize=None, cache=CACHE_PATH, profile=False):
+    # With adaptive=True, n_reps is only the first wave: samples that are not yet
+    # resolved (see sample_resolved) get further waves of `wave` replicates, up to max_reps.
+    # Records are appended to outfile + '.partial' as they complete; with a fixed seed
+    # the LHS design and every run's seed are reproducible, so rerunning an interrupted
+    # sweep only runs the tasks missing from the .partial file.
+    # Tasks go to the pool in chunks of chunksize runs (default: see chunk_size).
+    # Single runs are looked up in the result cache at `cache` (None to disable).
+    # profile=True times every run's hot path (instrument.Profiler), prints the totals
+    # per worker and saves them next to outfile as <name>_profile.json
     if diagnostic:
         print("Running diagnostic mode: small test run")
         n_samples = min(n_samples, 5)
         n_reps = min(n_reps, 2)
         outfile = "bee_results_diagnostic.csv"
 
-    configs = latin_hypercube_samples(n_samples, param_bounds)
-    tasks = []
+    configs = sample_configs(latin_hypercube_samples(n_samples, param_bounds, seed))
 
-    # Build all tasks
-    for i, pset in enumerate(configs):
-        cfg = dict(base_config)
-        cfg.update(pset)
-        for rep in range(n_reps):
-            tasks.append((cfg, i, rep))
-
-    records = []
-    total_runs = len(tasks)
+    # Replicates wanted per sample; adaptive waves raise it for unresolved samples
+    target = [n_reps] * len(configs)
+    submitted = set()
+    # Checkpoint keys of this sweep's tasks; a .partial left by a sweep with other
+    # arguments may hold records of other tasks, which are ignored
+    keys = set()
+    profiles = ProfileAggregator()
 
     # Default: use all available cores
     if n_workers is None:
         n_workers = multiprocessing.cpu_count()
 
-    with ProcessPoolExecutor(max_workers=n_workers) as executor:
-        futures = [executor.submit(run_single, cfg, i, rep) for (cfg, i, rep) in tasks]
-        for f in tqdm(as_completed(futures), total=total_runs, desc="Running simulations"):
-            records.append(f.result())
+    with Checkpoint(outfile, TASK_KEY, batch_size) as checkpoint, \
+            ProcessPoolExecutor(max_workers=n_workers, initializer=init_worker, initargs=(configs, cache)) as executor, \
+            tqdm(total=0, desc="Running simulations") as pbar:
+        while True:
+            tasks = []
+            for i, cfg in enumerate(configs):
+                for rep in range(target[i]):
+                    if (i, rep) in submitted:
+                        continue
+                    submitted.add((i, rep))
+                    s = task_seed(seed, i, rep)
+                    key = checkpoint.key({**cfg, 'sample_id': i, 'rep': rep, 'seed': s})
+                    keys.add(key)
+                    if key not in checkpoint.done:
+                        tasks.append((i, rep, s))
+            pbar.total += len(tasks)
+            pbar.refresh()
+            size = chunksize or chunk_size(len(tasks), n_workers, ensemble)
+            for rec in run_tasks(executor, tasks, engine, ensemble, size, profile):
+                if 'profile' in rec:
+                    profiles.add(rec.pop('profile'))
+                checkpoint.add(rec)
+                pbar.update(1)
+            if not adaptive:
+                break
+            by_sample = sample_records(sweep_records(checkpoint, keys), target)
+            grown = False
+            for i, recs in enumerate(by_sample):
+                if target[i] < max_reps and not sample_resolved(recs, ttd_width, success_width):
+                    target[i] = min(target[i] + wave, max_reps)
+                    grown = True
+            if not grown:
+                break
 
-    df = pd.DataFrame(records)
+        records = []
+        for recs in sample_records(sweep_records(checkpoint, keys), target):
+            records.extend({**rec, 'n_reps': len(recs)} for rec in sorted(recs, key=lambda r: r['rep']))
+        df = pd.DataFrame(records, columns=RECORD_COLUMNS + ['seed', 'n_reps'])
+        checkpoint.finish(df, RECORD_COLUMNS + ['n_reps'])
+        df = df[RECORD_COLUMNS + ['n_reps']]
+    store.save(df, outfile)
 
     # Print basic summary
     print("\nDiagnostic summary:" if diagnostic else "\nExperiment summary:")
@@ -129,16 +318,207 @@ def run_experiment(n_samples=20, n_reps=5, outfile="results.csv", n_workers=None
     # Compute and print total success rate
     total_success_rate = df['success'].mean()
     print(f"\nTotal success rate across all runs: {total_success_rate:.2%}")
+    if adaptive:
+        print(f"Replicates per sample: {df.groupby('sample_id')['n_reps'].first().describe().to_dict()}")
+    if profile:
+        print(profiles.summary())
+        profiles.save(os.path.splitext(outfile)[0] + '_profile.json')
 
-    df.to_csv(outfile, index=False)
     print(f"Saved results to {outfile}")
     return df
 
+# ---------------------------
+# Streaming aggregation for very large sweeps
+# ---------------------------
+def summarise_experiment(n_samples=20, n_reps=5, outfile="results.csv", summary_file=None, keep_records=False,
+                         n_workers=None, engine='object', ensemble=None, seed=0, chunksize=None, cache=CACHE_PATH):
+    # Runs the same sweep as run_experiment but keeps only a running summary per
+    # sample (aggregate.SweepSummary), updated as records complete and written to
+    # summary_file (default: <outfile>_summary.csv); returns it as a DataFrame. Tasks
+    # are generated and submitted lazily, so driver memory does not grow with n_reps.
+    # keep_records=True also appends every raw record to outfile as it arrives
+    # (in completion order). There is no checkpoint: an interrupted sweep starts over
+    summary_file = summary_file or os.path.splitext(outfile)[0] + '_summary.csv'
+    if n_workers is None:
+        n_workers = multiprocessing.cpu_count()
+
+    configs = sample_configs(latin_hypercube_samples(n_samples, param_bounds, seed))
+    tasks = ((i, rep, task_seed(seed, i, rep)) for i in range(len(configs)) for rep in range(n_reps))
+    n_tasks = len(configs) * n_reps
+    size = chunksize or chunk_size(n_tasks, n_workers, ensemble)
+
+    summary = SweepSummary(['sample_id', *param_bounds])
+    raw = open(outfile, 'w', newline='') if keep_records else None
+    try:
+        writer = csv.DictWriter(raw, fieldnames=RECORD_COLUMNS, extrasaction='ignore') if raw else None
+        if writer:
+            writer.writeheader()
+        with ProcessPoolExecutor(max_workers=n_workers, initializer=init_worker, initargs=(configs, cache)) as executor:
+            for rec in tqdm(stream_tasks(executor, tasks, engine, ensemble, size, 4 * n_workers), total=n_tasks,
+                            desc="Running simulations"):
+                summary.add(rec)
+                if writer:
+                    writer.writerow(rec)
+    finally:
+        if raw:
+            raw.close()
+
+    df = summary.to_frame()
+    df.to_csv(summary_file, index=False)
+    print(f"\nTotal success rate across all runs: {(df['success_rate'] * df['runs']).sum() / df['runs'].sum():.2%}")
+    print(f"Saved summary to {summary_file}" + (f" and results to {outfile}" if keep_records else ""))
+    return df
+
+# ---------------------------
+# Multi-host sweeps through a shared job queue
+# ---------------------------
+def run_distributed(n_samples=20, n_reps=5, outfile="results.csv", queue="sweep_queue.sqlite", local_workers=0,
+                    engine='object', seed=0, lease=600, poll=5.0, cache=CACHE_PATH):
+    # Writes every (config, rep, seed) task of the sweep to the job queue file `queue`;
+    # workers on any host that can reach it (python jobqueue.py <queue>) claim and run
+    # them, and outfile is assembled once all are done. local_workers starts that many
+    # worker processes on this host too. The sweep is named by outfile, so calling this
+    # again (e.g. after the coordinator died) only adds the tasks the queue lacks. Jobs
+    # are keyed by config and engine as well, so a rerun under the same outfile with
+    # other arguments queues its own tasks and only their results are used
+    configs = sample_configs(latin_hypercube_samples(n_samples, param_bounds, seed))
+
+    jobs = JobQueue(queue)
+    tasks = []
+    for i, cfg in enumerate(configs):
+        for rep in range(n_reps):
+            s = task_seed(seed, i, rep)
+            tasks.append(((i, rep, s, engine, params_key(cfg)),
+                          {'config': cfg, 'sample_id': i, 'rep': rep, 'seed': s, 'engine': engine}))
+    print(f"Queued {jobs.submit(outfile, tasks)} new tasks in {queue}")
+
+    workers = [multiprocessing.Process(target=work, args=(queue, lease, 1, poll, False, cache))
+               for _ in range(local_workers)]
+    for w in workers:
+        w.start()
+    with tqdm(total=len(tasks), desc="Waiting for workers") as pbar:
+        while jobs.unfinished(outfile):
+            counts = jobs.counts(outfile)
+            pbar.n = counts.get('done', 0) + counts.get('failed', 0)
+            pbar.refresh()
+            time.sleep(poll)
+    for w in workers:
+        w.join()
+
+    failed = jobs.counts(outfile).get('failed', 0)
+    if failed:
+        print(f"{failed} tasks failed; see the error column of the jobs table in {queue}")
+    records = []
+    for recs in sample_records(jobs.results(outfile, [key for key, _ in tasks]), [n_reps] * len(configs)):
+        records.extend({**rec, 'n_reps': len(recs)} for rec in sorted(recs, key=lambda r: r['rep']))
+    jobs.close()
+    df = pd.DataFrame(records, columns=RECORD_COLUMNS + ['n_reps'])
+    store.write_table(df, outfile)
+    print(f"Saved results to {outfile}")
+    store.save(df, outfile)
+    return df
+
+# ---------------------------
+# Global sensitivity analysis (Sobol indices, Saltelli design)
+# ---------------------------
+def saltelli_samples(n_base, param_bounds, seed=None):
+    # Rows of the A and B matrices followed by the d matrices AB_i (A with column i
+    # taken from B): n_base * (d + 2) parameter sets. n_base should be a power of 2
+    d = len(param_bounds)
+    base = qmc.Sobol(d=2 * d, seed=seed).random(n_base)
+    A, B = base[:, :d], base[:, d:]
+    AB = np.tile(A, (d, 1, 1))
+    for i in range(d):
+        AB[i, :, i] = B[:, i]
+    l_bounds = [param_bounds[p][0] for p in param_bounds]
+    u_bounds = [param_bounds[p][1] for p in param_bounds]
+    scaled = qmc.scale(np.vstack([A, B, *AB]), l_bounds, u_bounds)
+    return [dict(zip(param_bounds.keys(), row)) for row in scaled]
+
+
+def sobol_indices(f, n_base, n_params, n_boot=1000, confidence=0.95, seed=None):
+    """First-order (Saltelli 2010) and total-order (Jansen) Sobol indices from model
+    outputs f laid out as saltelli_samples rows, with bootstrap confidence intervals
+    over the n_base base rows. Returns {'S1', 'ST'} -> (estimate, low, high) arrays."""
+    f = np.asarray(f, dtype=float).reshape(n_params + 2, n_base)
+    fA, fB, fAB = f[0], f[1], f[2:]
+
+    def estimate(rows):
+        a, b, ab = fA[rows], fB[rows], fAB[:, rows]
+        var = np.var(np.r_[a, b])
+        if var == 0:
+            return np.zeros(n_params), np.zeros(n_params)
+        return np.mean(b * (ab - a), axis=1) / var, 0.5 * np.mean((a - ab) ** 2, axis=1) / var
+
+    s1, st = estimate(np.arange(n_base))
+    rng = np.random.default_rng(seed)
+    boot = [estimate(rng.integers(n_base, size=n_base)) for _ in range(n_boot)]
+    tail = 50 * (1 - confidence)
+    out = {}
+    for name, point, samples in (('S1', s1, [b[0] for b in boot]), ('ST', st, [b[1] for b in boot])):
+        low, high = np.percentile(samples, [tail, 100 - tail], axis=0)
+        out[name] = (point, low, high)
+    return out
+
+
+def run_sensitivity(n_base=256, n_reps=1, outfile="sobol_results.csv", summary_file="sobol_sensitivity_summary.csv",
+                    n_workers=None, engine='object', ensemble=None, seed=0, n_boot=1000, confidence=0.95,
+                    batch_size=50, chunksize=None, cache=CACHE_PATH):
+    # Runs the n_base * (len(param_bounds) + 2) parameter sets of a Saltelli design
+    # (n_reps replicates each, averaged) and writes first- and total-order Sobol
+    # indices for time_to_depletion (failed runs count as max_steps) and for success.
+    # The runs themselves go to outfile in the bee_results.csv format; sample_id is
+    # the row of the design. Like run_experiment, an interrupted run can be resumed
+    configs = sample_configs(saltelli_samples(n_base, param_bounds, seed))
+
+    if n_workers is None:
+        n_workers = multiprocessing.cpu_count()
+
+    with Checkpoint(outfile, TASK_KEY, batch_size) as checkpoint, \
+            ProcessPoolExecutor(max_workers=n_workers, initializer=init_worker, initargs=(configs, cache)) as executor:
+        tasks = []
+        keys = set()
+        for i, cfg in enumerate(configs):
+            for rep in range(n_reps):
+                s = task_seed(seed, i, rep)
+                key = checkpoint.key({**cfg, 'sample_id': i, 'rep': rep, 'seed': s})
+                keys.add(key)
+                if key not in checkpoint.done:
+                    tasks.append((i, rep, s))
+        size = chunksize or chunk_size(len(tasks), n_workers, ensemble)
+        for rec in tqdm(run_tasks(executor, tasks, engine, ensemble, size), total=len(tasks),
+                        desc="Running Saltelli design"):
+            checkpoint.add(rec)
+
+        records = [rec for recs in sample_records(sweep_records(checkpoint, keys), [n_reps] * len(configs))
+                   for rec in recs]
+        df = pd.DataFrame(sorted(records, key=lambda r: (r['sample_id'], r['rep'])), columns=RECORD_COLUMNS + ['seed'])
+        checkpoint.finish(df, RECORD_COLUMNS)
+    store.save(df[RECORD_COLUMNS], outfile)
+
+    ttd = df['time_to_depletion'].astype(float).fillna(base_config['max_steps'])
+    outputs = {'time_to_depletion': ttd.groupby(df['sample_id']).mean(),
+               'success': df['success'].astype(float).groupby(df['sample_id']).mean()}
+    rows = []
+    for output, f in outputs.items():
+        indices = sobol_indices(f.sort_index().to_numpy(), n_base, len(param_bounds), n_boot, confidence, seed)
+        for j, p in enumerate(param_bounds):
+            rows.append({'parameter': p, 'output': output,
+                         **{f'{name}{suffix}': vals[k][j] for name, vals in indices.items()
+                            for k, suffix in enumerate(('', '_low', '_high'))}})
+    summary = pd.DataFrame(rows)
+    summary.to_csv(summary_file, index=False)
+
+    print("\nSobol indices (time_to_depletion):")
+    print(summary[summary['output'] == 'time_to_depletion'].drop(columns='output').round(3).to_string(index=False))
+    print(f"Saved {len(df)} runs to {outfile} and indices to {summary_file}")
+    return summary
+
 # ---------------------------
 # Run if main
 # ---------------------------
 if __name__ == "__main__":
     # Example: use only half your cores
     df_diag = run_experiment(diagnostic=True)
-    df = run_experiment(n_samples=200, n_reps=15, outfile="bee_results.csv", n_workers=4)
+    df = run_experiment(n_samples=200, n_reps=5, outfile="bee_results.csv", n_workers=4, adaptive=True, max_reps=30)
     print(df.head())
@@ -0,0 +1,185 @@
+import json
+import os
+
+import numpy as np
+
+RECORD_MODES = ('all', 'off', 'every', 'ring')
+
+
+class History:
+    """Recorded frames of a run, kept in preallocated NumPy arrays: bee positions,
+    bee state codes (index into classes.STATES) and the strength of every nectar.
+
+    mode='all' keeps every step, 'off' keeps nothing, 'every' keeps every n-th step
+    and 'ring' keeps only the last n frames."""
+
+    def __init__(self, nectar_positions, mode='all', n=None):
+        if mode not in RECORD_MODES:
+            raise ValueError(f'Not valid record mode: {mode} should be one of {RECORD_MODES}')
+        if mode in ('every', 'ring') and not n:
+            raise ValueError(f'Record mode "{mode}" needs n')
+        self.nectar_positions = np.asarray(nectar_positions, dtype=float).reshape(-1, 2)
+        self.mode = mode
+        self.n = n
+        self.count = 0
+        self.steps = self.positions = self.states = self.strengths = None
+
+    def recording(self, step):
+        return self.mode == 'all' or self.mode == 'ring' or (self.mode == 'every' and step % self.n == 0)
+
+    def append(self, step, positions, states, strengths):
+        if self.positions is None:
+            capacity = self.n if self.mode == 'ring' else 256
+            self.steps = np.zeros(capacity, dtype=np.int64)
+            self.positions = np.zeros((capacity, len(positions), 2))
+            self.states = np.zeros((capacity, len(states)), dtype=np.int8)
+            self.strengths = np.zeros((capacity, len(strengths)))
+        if self.mode == 'ring':
+            i = self.count % self.n
+        else:
+            i = self.count
+            if i == len(self.steps):
+                self._grow()
+        self.steps[i] = step
+        self.positions[i] = positions
+        self.states[i] = states
+        self.strengths[i] = strengths
+        self.count += 1
+
+    def _grow(self):
+        for name in ('steps', 'positions', 'states', 'strengths'):
+            arr = getattr(self, name)
+            setattr(self, name, np.concatenate([arr, np.zeros_like(arr)]))
+
+    def _slot(self, frame):
+        if frame < 0:
+            frame += len(self)
+        if not 0 <= frame < len(self):
+            raise IndexError(f'Frame {frame} not recorded ({len(self)} frames)')
+        if self.mode == 'ring' and self.count > self.n:
+            return (self.count + frame) % self.n
+        return frame
+
+    def __len__(self):
+        return min(self.count, self.n) if self.mode == 'ring' else self.count
+
+    def frame(self, frame):
+        """(positions, state codes, nectar strengths) of a recorded frame, oldest first."""
+        i = self._slot(frame)
+        return self.positions[i], self.states[i], self.strengths[i]
+
+    def step(self, frame):
+        return int(self.steps[self._slot(frame)])
+
+    def flush(self):
+        pass
+
+    def reader(self):
+        return self
+
+
+class TrajectoryWriter(History):
+    """History that streams frames to disk instead of keeping them in memory. Frames
+    are buffered into chunks of chunk_size and each full chunk is written as one .npy
+    file per field, next to an index.json that is rewritten after every chunk, so an
+    interrupted run can still be replayed up to its last flushed chunk."""
+
+    FIELDS = ('steps', 'positions', 'states', 'strengths')
+
+    def __init__(self, path, nectar_positions, mode='all', n=None, chunk_size=1000, meta=None):
+        if mode not in ('all', 'every'):
+            raise ValueError(f'Record mode "{mode}" cannot be streamed, use "all" or "every"')
+        super().__init__(nectar_positions, mode, n)
+        self.path = path
+        self.chunk_size = chunk_size
+        self.meta = meta or {}
+        self.chunks = []
+        self.buffered = 0
+        os.makedirs(path, exist_ok=True)
+        np.save(os.path.join(path, 'nectars.npy'), self.nectar_positions)
+        self._write_index()
+
+    def append(self, step, positions, states, strengths):
+        if self.positions is None:
+            self.steps = np.zeros(self.chunk_size, dtype=np.int64)
+            self.positions = np.zeros((self.chunk_size, len(positions), 2))
+            self.states = np.zeros((self.chunk_size, len(states)), dtype=np.int8)
+            self.strengths = np.zeros((self.chunk_size, len(strengths)))
+        i = self.buffered
+        self.steps[i] = step
+        self.positions[i] = positions
+        self.states[i] = states
+        self.strengths[i] = strengths
+        self.buffered += 1
+        self.count += 1
+        if self.buffered == self.chunk_size:
+            self.flush()
+
+    def flush(self):
+        if self.buffered == 0:
+            return
+        chunk = len(self.chunks)
+        for name in self.FIELDS:
+            np.save(os.path.join(self.path, f'chunk_{chunk:05d}_{name}.npy'), getattr(self, name)[:self.buffered])
+        self.chunks.append(self.buffered)
+        self.buffered = 0
+        self._write_index()
+
+    def _write_index(self):
+        index = {'meta': self.meta, 'chunks': self.chunks, 'frames': sum(self.chunks)}
+        tmp = os.path.join(self.path, 'index.json.tmp')
+        with open(tmp, 'w') as f:
+            json.dump(index, f)
+        os.replace(tmp, os.path.join(self.path, 'index.json'))
+
+    def frame(self, frame):
+        return self.reader().frame(frame)
+
+    def step(self, frame):
+        return self.reader().step(frame)
+
+    def reader(self):
+        self.flush()
+        return Trajectory(self.path)
+
+
+class Trajectory:
+    """Read-only view of a trajectory written by TrajectoryWriter. Chunks are
+    memory-mapped on demand, so only the frames actually asked for are read."""
+
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, 'index.json')) as f:
+            index = json.load(f)
+        self.meta = index['meta']
+        self.offsets = np.cumsum([0] + index['chunks'])
+        self.nectar_positions = np.load(os.path.join(path, 'nectars.npy'))
+        self._chunk = None
+        self._arrays = None
+
+    def __len__(self):
+        return int(self.offsets[-1])
+
+    def _locate(self, frame):
+        if frame < 0:
+            frame += len(self)
+        if not 0 <= frame < len(self):
+            raise IndexError(f'Frame {frame} not recorded ({len(self)} frames)')
+        chunk = int(np.searchsorted(self.offsets, frame, side='right')) - 1
+        if chunk != self._chunk:
+            self._arrays = {name: np.load(os.path.join(self.path, f'chunk_{chunk:05d}_{name}.npy'), mmap_mode='r')
+                            for name in TrajectoryWriter.FIELDS}
+            self._chunk = chunk
+        return frame - self.offsets[chunk]
+
+    def frame(self, frame):
+        i = self._locate(frame)
+        return (np.asarray(self._arrays['positions'][i]), np.asarray(self._arrays['states'][i]),
+                np.asarray(self._arrays['strengths'][i]))
+
+    def step(self, frame):
+        i = self._locate(frame)
+        return int(self._arrays['steps'][i])
+
+    def reader(self):
+        return self
@@ -0,0 +1,168 @@
+import json
+import os
+import threading
+import time
+from collections import defaultdict
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
+from classes import STATES
+
+# Sections timed on top of the per-state branches of Bee.update
+BEE_SECTIONS = ('sense_nectar', 'move', 'land')
+ENV_SECTIONS = ('update', 'record_state')
+# Their counterparts in the vector engine, which has no per-bee update
+SWARM_SECTIONS = {'sense': 'sense_nectar', 'move_straight': 'move', 'move_random': 'move'}
+
+
+def peak_rss_mb():
+    # Peak resident memory of this process so far (ru_maxrss is in kB on Linux, bytes on macOS)
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 2 ** 20 if os.uname().sysname == 'Darwin' else peak / 2 ** 10
+
+
+class Profiler:
+    """Opt-in timing of one environment's hot path. attach() wraps the methods of
+    that environment and its bees (instance attributes shadowing the class methods),
+    so unprofiled runs execute the unchanged code and pay nothing.
+
+    Records calls and cumulative seconds of Environment.update and record_state, of
+    Bee.update per state branch (the bee's state on entry), and of sense_nectar,
+    move and land; branch times include the sections called inside them. Bees added
+    after attach() are not timed. With the vector engine only the environment
+    sections and the vectorized sense/move kernels are timed.
+
+    Each thread counts into its own counters, merged by result(), so sections
+    timed from several threads do not lose counts; their times add up across
+    threads and can then exceed the wall time."""
+
+    def __init__(self):
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._threads = []
+        self.start = None
+
+    def _counters(self):
+        # (calls, times, state_calls, state_times) of the calling thread
+        counters = getattr(self._local, 'counters', None)
+        if counters is None:
+            counters = self._local.counters = (defaultdict(int), defaultdict(float), defaultdict(int),
+                                               defaultdict(float))
+            with self._lock:
+                self._threads.append(counters)
+        return counters
+
+    def _timed(self, name, fn):
+        counters, clock = self._counters, time.perf_counter
+
+        def timed(*args, **kwargs):
+            t0 = clock()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                calls, times = counters()[:2]
+                times[name] += clock() - t0
+                calls[name] += 1
+        return timed
+
+    def _timed_update(self, bee):
+        fn, counters, clock = bee.update, self._counters, time.perf_counter
+
+        def update():
+            state = bee.state
+            t0 = clock()
+            try:
+                return fn()
+            finally:
+                calls, times = counters()[2:]
+                times[state] += clock() - t0
+                calls[state] += 1
+        return update
+
+    def _merged(self, k):
+        with self._lock:
+            threads = list(self._threads)
+        total = defaultdict(float if k % 2 else int)
+        for counters in threads:
+            for name, value in counters[k].items():
+                total[name] += value
+        return total
+
+    def attach(self, env):
+        for name in ENV_SECTIONS:
+            setattr(env, name, self._timed(name, getattr(env, name)))
+        if hasattr(env, 'step'):
+            for name, section in SWARM_SECTIONS.items():
+                setattr(env, name, self._timed(section, getattr(env, name)))
+        for bee in getattr(env, 'bees', ()):
+            for name in BEE_SECTIONS:
+                setattr(bee, name, self._timed(name, getattr(bee, name)))
+            bee.update = self._timed_update(bee)
+        self.start = time.perf_counter()
+        return self
+
+    def result(self):
+        calls, times, state_calls, state_times = (self._merged(k) for k in range(4))
+        return {
+            'runs': 1,
+            'wall': time.perf_counter() - self.start,
+            'sections': {name: {'calls': calls[name], 'time': times[name]}
+                         for name in ENV_SECTIONS + BEE_SECTIONS},
+            'states': {state: {'calls': state_calls[state], 'time': state_times[state]}
+                       for state in STATES},
+            'peak_rss_mb': peak_rss_mb(),
+            'worker': os.getpid(),
+        }
+
+
+def merge_profiles(a, b):
+    """Sum of two profile dicts (from Profiler.result or earlier merges); peak memory is the max."""
+    if a is None:
+        return b
+    out = {'runs': a['runs'] + b['runs'], 'wall': a['wall'] + b['wall'], 'worker': a['worker']}
+    for group in ('sections', 'states'):
+        out[group] = {name: {k: a[group][name][k] + b[group][name][k] for k in ('calls', 'time')}
+                      for name in a[group]}
+    peaks = [p for p in (a['peak_rss_mb'], b['peak_rss_mb']) if p is not None]
+    out['peak_rss_mb'] = max(peaks) if peaks else None
+    return out
+
+
+class ProfileAggregator:
+    """Profiles of a sweep's runs, merged per worker process."""
+
+    def __init__(self):
+        self.workers = {}
+
+    def add(self, profile):
+        self.workers[profile['worker']] = merge_profiles(self.workers.get(profile['worker']), profile)
+
+    def total(self):
+        total = None
+        for profile in self.workers.values():
+            total = merge_profiles(total, profile)
+        return total
+
+    def summary(self):
+        total = self.total()
+        if total is None:
+            return "No profiled runs"
+        lines = [f"{total['runs']} profiled runs on {len(self.workers)} workers, {total['wall']:.2f}s in total"]
+        for group in ('states', 'sections'):
+            for name, s in sorted(total[group].items(), key=lambda kv: -kv[1]['time']):
+                if s['calls']:
+                    lines.append(f"  {name:14} {s['calls']:10d} calls {s['time']:9.3f}s "
+                                 f"({s['time'] / total['wall']:.1%} of wall)")
+        for worker, profile in self.workers.items():
+            lines.append(f"  worker {worker}: {profile['runs']} runs, {profile['wall']:.2f}s, "
+                         f"peak {profile['peak_rss_mb'] or float('nan'):.0f} MB")
+        return "\n".join(lines)
+
+    def save(self, path):
+        with open(path, 'w') as f:
+            json.dump({'total': self.total(), 'workers': {str(w): p for w, p in self.workers.items()}}, f, indent=1)
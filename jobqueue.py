@@ -0,0 +1,195 @@
+import argparse
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+
+from cache import CACHE_PATH
+
+# A job is retried this many times (e.g. after its worker died and the lease ran
+# out) before it is marked failed
+MAX_ATTEMPTS = 3
+
+
+def worker_name():
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+class JobQueue:
+    """Sweep tasks in an SQLite file that any number of workers, on any host that
+    can reach the file, claim and complete. A claim is a lease: a job whose worker
+    has not completed or renewed it within the lease goes back to the queue. Workers
+    renew their leases from a Heartbeat while they run, so a lease only runs out
+    once its worker is gone, and only then does the retry count against the job. Jobs
+    belong to a sweep and are unique by key within it, so submitting a sweep again
+    only adds the jobs it does not have yet.
+
+    The file must be on a filesystem with working file locks, which many NFS
+    setups lack."""
+
+    def __init__(self, path):
+        self.path = path
+        self.db = sqlite3.connect(path, timeout=60, isolation_level=None)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('CREATE TABLE IF NOT EXISTS jobs '
+                        '(id INTEGER PRIMARY KEY, sweep TEXT, key TEXT, task TEXT, state TEXT, worker TEXT, '
+                        'lease_until REAL, attempts INTEGER DEFAULT 0, result TEXT, error TEXT, '
+                        'UNIQUE (sweep, key))')
+        self.db.execute('CREATE INDEX IF NOT EXISTS jobs_state ON jobs (state, lease_until)')
+
+    def submit(self, sweep, tasks):
+        """Add (key, task) pairs, task being a JSON-serializable dict; returns how many were new."""
+        self.db.execute('BEGIN IMMEDIATE')
+        before = self.db.total_changes
+        self.db.executemany("INSERT OR IGNORE INTO jobs (sweep, key, task, state) VALUES (?, ?, ?, 'pending')",
+                            [(sweep, json.dumps(key), json.dumps(task, default=lambda v: v.item()))
+                             for key, task in tasks])
+        self.db.execute('COMMIT')
+        return self.db.total_changes - before
+
+    def claim(self, worker, lease=600, n=1):
+        """Atomically lease up to n jobs that are pending or whose lease ran out;
+        returns [(id, task)]."""
+        now = time.time()
+        self.db.execute('BEGIN IMMEDIATE')
+        try:
+            # Jobs whose last allowed attempt timed out are given up on
+            self.db.execute("UPDATE jobs SET state = 'failed', error = 'lease expired' WHERE state = 'running' "
+                            "AND lease_until < ? AND attempts >= ?", (now, MAX_ATTEMPTS))
+            rows = self.db.execute("SELECT id, task FROM jobs WHERE state = 'pending' OR "
+                                   "(state = 'running' AND lease_until < ?) LIMIT ?", (now, n)).fetchall()
+            self.db.executemany("UPDATE jobs SET state = 'running', worker = ?, lease_until = ?, "
+                                "attempts = attempts + 1 WHERE id = ?", [(worker, now + lease, i) for i, _ in rows])
+            self.db.execute('COMMIT')
+        except BaseException:
+            self.db.execute('ROLLBACK')
+            raise
+        return [(i, json.loads(task)) for i, task in rows]
+
+    def renew(self, ids, worker, lease=600):
+        self.db.executemany("UPDATE jobs SET lease_until = ? WHERE id = ? AND worker = ? AND state = 'running'",
+                            [(time.time() + lease, i, worker) for i in ids])
+
+    def complete(self, job_id, result):
+        # The first result wins, should a job whose lease ran out be finished twice
+        self.db.execute("UPDATE jobs SET state = 'done', result = ? WHERE id = ? AND state != 'done'",
+                        (json.dumps(result, default=lambda v: v.item()), job_id))
+
+    def fail(self, job_id, error, max_attempts=MAX_ATTEMPTS):
+        # Back to the queue for another attempt, or failed for good
+        self.db.execute("UPDATE jobs SET state = CASE WHEN attempts >= ? THEN 'failed' ELSE 'pending' END, "
+                        "error = ?, lease_until = NULL WHERE id = ? AND state = 'running'",
+                        (max_attempts, error, job_id))
+
+    def counts(self, sweep=None):
+        query = 'SELECT state, COUNT(*) FROM jobs' + (' WHERE sweep = ?' if sweep else '') + ' GROUP BY state'
+        return dict(self.db.execute(query, (sweep,) if sweep else ()).fetchall())
+
+    def results(self, sweep, keys=None):
+        # Results of the sweep's finished jobs, only of those keyed in keys if given
+        wanted = None if keys is None else {json.dumps(key) for key in keys}
+        return [json.loads(r) for k, r in
+                self.db.execute("SELECT key, result FROM jobs WHERE sweep = ? AND state = 'done' ORDER BY id", (sweep,))
+                if wanted is None or k in wanted]
+
+    def unfinished(self, sweep=None):
+        counts = self.counts(sweep)
+        return counts.get('pending', 0) + counts.get('running', 0)
+
+    def close(self):
+        self.db.close()
+
+
+class Heartbeat:
+    """Renews the leases of a worker's outstanding jobs every lease/3 seconds from a
+    background thread with its own connection, so a job that runs longer than the
+    lease is not handed to another worker while its own worker is alive."""
+
+    def __init__(self, path, worker, lease=600):
+        self.path, self.worker, self.lease = path, worker, lease
+        self.ids = []
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._beat, name='jobqueue-heartbeat', daemon=True)
+
+    def hold(self, ids):
+        # The jobs whose leases to keep renewing
+        with self.lock:
+            self.ids = list(ids)
+
+    def _beat(self):
+        queue = JobQueue(self.path)
+        try:
+            while not self.stopped.wait(self.lease / 3):
+                with self.lock:
+                    ids = list(self.ids)
+                try:
+                    if ids:
+                        queue.renew(ids, self.worker, self.lease)
+                except sqlite3.OperationalError:
+                    # Queue busy for longer than the connection timeout; try again next beat
+                    pass
+        finally:
+            queue.close()
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stopped.set()
+        self.thread.join()
+        return False
+
+
+def work(path, lease=600, n=1, poll=5.0, wait=False, cache=CACHE_PATH, worker=None):
+    """Worker loop: claim n jobs at a time from the queue at path and run each with
+    experiment.run_single, keeping the leases of the claimed jobs alive with a
+    Heartbeat. Returns once the queue has nothing left to do, or keeps polling every
+    `poll` seconds if wait."""
+    from experiment import run_single
+    from cache import ResultCache
+
+    queue = JobQueue(path)
+    worker = worker or worker_name()
+    result_cache = ResultCache(cache) if cache else None
+    done = 0
+    with Heartbeat(path, worker, lease) as heartbeat:
+        while True:
+            jobs = queue.claim(worker, lease, n)
+            if not jobs:
+                if not wait and queue.unfinished() == 0:
+                    break
+                # Other workers still hold leases; one of them may die and free its jobs
+                time.sleep(poll)
+                continue
+            for k, (job_id, task) in enumerate(jobs):
+                heartbeat.hold([i for i, _ in jobs[k:]])
+                try:
+                    record = run_single(task['config'], task['sample_id'], task['rep'], task['engine'],
+                                        task['seed'], result_cache)
+                except Exception as e:
+                    queue.fail(job_id, repr(e))
+                    continue
+                queue.complete(job_id, record)
+                done += 1
+            heartbeat.hold([])
+    queue.close()
+    return done
+
+
+if __name__ == "__main__":
+    # Start a worker on any host that can reach the queue file:
+    #   python jobqueue.py sweep_queue.sqlite
+    parser = argparse.ArgumentParser(description="Run sweep jobs from a shared job queue")
+    parser.add_argument('queue', help="path of the SQLite job queue")
+    parser.add_argument('--lease', type=float, default=600, help="seconds before an unfinished job is retried")
+    parser.add_argument('--batch', type=int, default=1, help="jobs claimed at a time")
+    parser.add_argument('--poll', type=float, default=5.0)
+    parser.add_argument('--wait', action='store_true', help="keep polling once the queue is empty")
+    parser.add_argument('--no-cache', action='store_true', help="do not use the result cache")
+    args = parser.parse_args()
+    n = work(args.queue, args.lease, args.batch, args.poll, args.wait, None if args.no_cache else CACHE_PATH)
+    print(f"{worker_name()} finished {n} jobs")
@@ -0,0 +1,52 @@
+import math
+
+import numpy as np
+
+# Slack, in steps, on every analytic crossing. Rounding can only make a bee wake a
+# step early, never late: an early bee runs a normal update and plans again.
+EPS = 1e-7
+
+
+def following_steps(position, step, hive_position, reach, nectar_positions, sense_range, bounds):
+    """Steps a following bee at position can keep moving by step before its update
+    has to run again: when it is first within sense_range of one of
+    nectar_positions, first at least reach from the hive, or about to be clipped
+    to bounds (width, length). Returns 0 if that is already the case."""
+    p, v = np.asarray(position, dtype=float), np.asarray(step, dtype=float)
+    a = float(v @ v)
+    offset = p - np.asarray(hive_position, dtype=float)
+    if reach <= 0 or offset @ offset >= reach * reach:
+        return 0
+    # |offset + i*v| grows past reach after the larger root of the quadratic
+    b, c = 2 * float(offset @ v), float(offset @ offset) - reach * reach
+    steps = math.ceil((-b + math.sqrt(b * b - 4 * a * c)) / (2 * a) - EPS)
+
+    # Moves stop being pure once the next one would be clipped; x is clipped to
+    # width and y to length, as in Bee.move
+    for x, dx, limit in ((p[0], v[0], bounds[0]), (p[1], v[1], bounds[1])):
+        if dx > 0:
+            steps = min(steps, max(0, math.floor((limit - x) / dx - EPS)))
+        elif dx < 0:
+            steps = min(steps, max(0, math.floor(x / -dx - EPS)))
+
+    nectar_positions = np.asarray(nectar_positions, dtype=float).reshape(-1, 2)
+    if len(nectar_positions):
+        rel = p - nectar_positions
+        bs = 2 * (rel @ v)
+        cs = np.einsum('ij,ij->i', rel, rel) - sense_range * sense_range
+        disc = bs * bs - 4 * a * cs
+        near = disc >= 0
+        root = np.sqrt(disc[near])
+        lo = np.maximum(0, np.ceil((-bs[near] - root) / (2 * a) - EPS))
+        hi = (-bs[near] + root) / (2 * a)
+        hits = lo[lo <= hi + EPS]
+        if len(hits):
+            steps = min(steps, int(hits.min()))
+    return steps
+
+
+def returning_steps(position, hive_position, hive_radius, dt):
+    """Steps a returning bee at position can keep moving dt straight towards the
+    hive before its update has to run again, i.e. before it is within hive_radius."""
+    distance = math.dist(position, hive_position)
+    return max(0, math.ceil((distance - hive_radius) / dt - EPS))
@@ -0,0 +1,44 @@
+import numpy as np
+
+
+class NectarTable:
+    """Nectars of an environment, indexed by id, with an active flag per nectar and a
+    count of the ones still active. Bees take nectar through take(); a nectar that
+    runs dry stays active until deplete() at the end of the step, as when depleted
+    nectars were dropped once every bee had moved.
+
+    Iterating or taking len() covers active nectars only, so the table reads like the
+    old list of remaining nectars; table[id] keeps working after depletion."""
+
+    def __init__(self, nectars):
+        self.table = list(nectars)
+        self.positions = np.array([n['position'] for n in self.table], dtype=float).reshape(-1, 2)
+        self.active = np.array([n['strength'] > 0 for n in self.table], dtype=bool)
+        self.live = int(self.active.sum())
+        self.pending = []
+
+    def take(self, nid, amount=1):
+        nec = self.table[nid]
+        nec['strength'] -= amount
+        if nec['strength'] <= 0 and self.active[nid]:
+            self.pending.append(nid)
+
+    def deplete(self):
+        """Deactivate the nectars that ran dry this step; returns them."""
+        depleted = []
+        for nid in self.pending:
+            if self.active[nid]:
+                self.active[nid] = False
+                self.live -= 1
+                depleted.append(self.table[nid])
+        self.pending.clear()
+        return depleted
+
+    def __len__(self):
+        return self.live
+
+    def __iter__(self):
+        return (nec for nec, active in zip(self.table, self.active) if active)
+
+    def __getitem__(self, nid):
+        return self.table[nid]
@@ -0,0 +1,227 @@
+import os
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+import pandas as pd
+from scipy.optimize import minimize
+from scipy.spatial.distance import cdist
+from scipy.stats import norm, qmc
+from tqdm import tqdm
+
+from experiment import (base_config, param_bounds, latin_hypercube_samples, task_seed, init_worker,
+                        run_config_chunk, chunk_size, RECORD_COLUMNS)
+from cache import CACHE_PATH
+
+# ---------------------------
+# Search space: param_bounds mapped onto the unit cube
+# ---------------------------
+PARAMS = list(param_bounds)
+LOWER = np.array([param_bounds[p][0] for p in PARAMS], dtype=float)
+UPPER = np.array([param_bounds[p][1] for p in PARAMS], dtype=float)
+
+
+def to_unit(params):
+    return (np.array([params[p] for p in PARAMS], dtype=float) - LOWER) / (UPPER - LOWER)
+
+
+def from_unit(x):
+    return dict(zip(PARAMS, (LOWER + np.clip(x, 0, 1) * (UPPER - LOWER)).tolist()))
+
+# ---------------------------
+# Surrogate model
+# ---------------------------
+class GaussianProcess:
+    """GP regression on the unit cube with an ARD Matern 5/2 kernel. Targets are
+    standardized, and the length scales, signal variance and noise variance are
+    fitted by maximizing the marginal likelihood (a few L-BFGS restarts)."""
+
+    def __init__(self, restarts=3, seed=None):
+        self.restarts = restarts
+        self.rng = np.random.default_rng(seed)
+        self.theta = None
+
+    @staticmethod
+    def kernel(A, B, lengthscales, signal):
+        r = np.sqrt(5) * cdist(A / lengthscales, B / lengthscales)
+        return signal * (1 + r + r * r / 3) * np.exp(-r)
+
+    def _factor(self, theta):
+        d = self.X.shape[1]
+        lengthscales, signal, noise = np.exp(theta[:d]), np.exp(theta[d]), np.exp(theta[d + 1])
+        K = self.kernel(self.X, self.X, lengthscales, signal) + (noise + 1e-8) * np.eye(len(self.X))
+        return np.linalg.cholesky(K)
+
+    def _nll(self, theta):
+        try:
+            L = self._factor(theta)
+        except np.linalg.LinAlgError:
+            return 1e10
+        alpha = np.linalg.solve(L.T, np.linalg.solve(L, self.y))
+        return 0.5 * self.y @ alpha + np.log(np.diag(L)).sum()
+
+    def fit(self, X, y, theta=None):
+        """Fit to (X, y); with theta given, reuse those hyperparameters instead of
+        fitting them (used for the fantasy points of a batch)."""
+        self.X = np.asarray(X, dtype=float)
+        y = np.asarray(y, dtype=float)
+        self.mean, self.scale = y.mean(), y.std() or 1.0
+        self.y = (y - self.mean) / self.scale
+        d = self.X.shape[1]
+        if theta is None:
+            bounds = [(np.log(0.02), np.log(10.0))] * d + [(np.log(0.05), np.log(20.0)), (np.log(1e-6), np.log(1.0))]
+            starts = [np.r_[np.full(d, np.log(0.3)), 0.0, np.log(0.1)]]
+            starts += [np.array([self.rng.uniform(lo, hi) for lo, hi in bounds]) for _ in range(self.restarts - 1)]
+            fits = [minimize(self._nll, x0, method='L-BFGS-B', bounds=bounds) for x0 in starts]
+            theta = min(fits, key=lambda f: f.fun).x
+        self.theta = theta
+        self.L = self._factor(theta)
+        self.alpha = np.linalg.solve(self.L.T, np.linalg.solve(self.L, self.y))
+        return self
+
+    def predict(self, Xs):
+        d = self.X.shape[1]
+        lengthscales, signal = np.exp(self.theta[:d]), np.exp(self.theta[d])
+        Ks = self.kernel(np.asarray(Xs, dtype=float), self.X, lengthscales, signal)
+        v = np.linalg.solve(self.L, Ks.T)
+        var = np.maximum(signal - np.einsum('ij,ij->j', v, v), 1e-12)
+        return self.mean + self.scale * (Ks @ self.alpha), self.scale * np.sqrt(var)
+
+# ---------------------------
+# Observations and acquisition
+# ---------------------------
+def summarise(records):
+    # One row per evaluated point: unit-cube position, mean time_to_depletion over
+    # successful runs (NaN if none), success rate and number of runs
+    df = pd.DataFrame(records)
+    rows = []
+    for _, group in df.groupby('sample_id'):
+        ttd = group['time_to_depletion'].dropna()
+        rows.append({'x': to_unit(group.iloc[0]), 'ttd': ttd.mean() if len(ttd) else np.nan,
+                     'success': group['success'].astype(float).mean(), 'n': len(group)})
+    return rows
+
+
+def best_point(obs, min_success):
+    feasible = [o for o in obs if o['success'] >= min_success and not np.isnan(o['ttd'])]
+    return min(feasible, key=lambda o: o['ttd']) if feasible else None
+
+
+def expected_improvement(mean, std, best):
+    # For minimization
+    z = (best - mean) / std
+    return (best - mean) * norm.cdf(z) + std * norm.pdf(z)
+
+
+def propose(obs, batch_size, min_success, rng, n_candidates=4096):
+    """Next batch of unit-cube points: constrained expected improvement (EI on log
+    mean time_to_depletion times the probability that the success rate reaches
+    min_success), maximized over random candidates and perturbations of the best
+    points. The batch is filled one point at a time, each chosen point being added
+    as a fantasy observation at the surrogates' prediction (kriging believer)."""
+    X = np.array([o['x'] for o in obs])
+    success = np.array([o['success'] for o in obs])
+    solved = np.array([not np.isnan(o['ttd']) for o in obs])
+    log_ttd = np.log([o['ttd'] for o in obs if not np.isnan(o['ttd'])])
+
+    feas_gp = GaussianProcess(seed=rng.integers(2 ** 32)).fit(X, success)
+    ttd_gp = GaussianProcess(seed=rng.integers(2 ** 32)).fit(X[solved], log_ttd) if solved.sum() >= 2 else None
+    best = best_point(obs, min_success)
+    best_log = np.log(best['ttd']) if best else None
+
+    # Candidates: a scrambled Sobol set plus local moves around the fastest points
+    candidates = qmc.Sobol(d=X.shape[1], seed=rng.integers(2 ** 32)).random(n_candidates)
+    order = np.argsort(np.where(solved, [o['ttd'] for o in obs], np.inf))[:5]
+    local = X[order].repeat(n_candidates // 8, axis=0)
+    candidates = np.vstack([candidates, np.clip(local + rng.normal(0, 0.05, local.shape), 0, 1)])
+
+    batch = []
+    for _ in range(batch_size):
+        mean_s, std_s = feas_gp.predict(candidates)
+        acq = norm.cdf((mean_s - min_success) / std_s)
+        if ttd_gp is not None and best_log is not None:
+            mean_t, std_t = ttd_gp.predict(candidates)
+            acq = acq * expected_improvement(mean_t, std_t, best_log)
+        pick = candidates[np.argmax(acq)]
+        batch.append(pick)
+        candidates = np.delete(candidates, np.argmax(acq), axis=0)
+
+        # Believe the surrogates at the chosen point while picking the rest of the batch
+        X = np.vstack([X, pick])
+        success = np.r_[success, feas_gp.predict(pick[None])[0]]
+        feas_gp.fit(X, success, feas_gp.theta)
+        if ttd_gp is not None:
+            log_ttd = np.r_[log_ttd, ttd_gp.predict(pick[None])[0]]
+            solved = np.r_[solved, True]
+            ttd_gp.fit(X[solved], log_ttd, ttd_gp.theta)
+    return batch
+
+# ---------------------------
+# Optimization loop
+# ---------------------------
+def evaluate(executor, points, first_id, n_reps, engine, seed, n_workers):
+    # Runs n_reps replicates of each point on the pool; returns experiment-style records
+    tasks = []
+    for j, params in enumerate(points):
+        cfg = dict(base_config)
+        cfg.update(params)
+        tasks.extend((cfg, first_id + j, rep, task_seed(seed, first_id + j, rep)) for rep in range(n_reps))
+    size = chunk_size(len(tasks), n_workers)
+    futures = [executor.submit(run_config_chunk, tasks[b:b + size], engine) for b in range(0, len(tasks), size)]
+    return [rec for f in as_completed(futures) for rec in f.result()]
+
+
+def optimise(n_iter=10, batch_size=None, n_reps=5, n_init=None, min_success=0.8, warm_start="bee_results.csv",
+             outfile="optimise_results.csv", n_workers=None, engine='object', seed=1, cache=CACHE_PATH):
+    # Minimizes mean time_to_depletion over param_bounds subject to a success rate of
+    # at least min_success. Each of the n_iter rounds evaluates batch_size points
+    # (default: one per worker) with n_reps replicates each. Results of an earlier
+    # sweep in warm_start (bee_results.csv format) seed the surrogates; without them
+    # the first round is an LHS design of n_init points
+    if n_workers is None:
+        n_workers = multiprocessing.cpu_count()
+    batch_size = batch_size or n_workers
+    rng = np.random.default_rng(seed)
+
+    obs = []
+    if warm_start and os.path.exists(warm_start):
+        obs = summarise(pd.read_csv(warm_start))
+        print(f"Warm start: {len(obs)} points from {warm_start}")
+
+    records = []
+    next_id = 0
+    with ProcessPoolExecutor(max_workers=n_workers, initializer=init_worker, initargs=([], cache)) as executor:
+        for it in tqdm(range(n_iter), desc="Optimizing"):
+            if len(obs) < 2:
+                points = latin_hypercube_samples(n_init or 2 * batch_size, param_bounds, seed)
+            else:
+                points = [from_unit(x) for x in propose(obs, batch_size, min_success, rng)]
+            new = evaluate(executor, points, next_id, n_reps, engine, seed, n_workers)
+            next_id += len(points)
+            records.extend(sorted(new, key=lambda r: (r['sample_id'], r['rep'])))
+            obs.extend(summarise(new))
+
+            best = best_point(obs, min_success)
+            if best is not None:
+                tqdm.write(f"Round {it + 1}: best mean time_to_depletion {best['ttd']:.1f} "
+                           f"(success {best['success']:.0%})")
+
+    df = pd.DataFrame(records, columns=RECORD_COLUMNS)
+    df.to_csv(outfile, index=False)
+    print(f"Saved {len(df)} runs to {outfile}")
+
+    best = best_point(obs, min_success)
+    if best is None:
+        print(f"No point reached a success rate of {min_success:.0%}")
+        return None, df
+    params = from_unit(best['x'])
+    print(f"Best parameters (mean time_to_depletion {best['ttd']:.1f}, success {best['success']:.0%}):")
+    for k, v in params.items():
+        print(f"  {k}: {v:.4g}")
+    return params, df
+
+# ---------------------------
+# Run if main
+# ---------------------------
+if __name__ == "__main__":
+    best_params, df = optimise(n_iter=10, n_reps=5, n_workers=4)
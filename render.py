@@ -0,0 +1,288 @@
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from classes import STATES
+
+# matplotlib is only imported by pyplot(), the first time something is drawn, so
+# simulations and sweep workers never load it
+matplotlib = None
+
+
+def headless():
+    # No display to open a window on: not on Windows or macOS and no X11/Wayland display
+    return (sys.platform.startswith('linux') and not os.environ.get('DISPLAY')
+            and not os.environ.get('WAYLAND_DISPLAY'))
+
+
+def pyplot(offscreen=False):
+    """matplotlib.pyplot, imported on first use. Without a display (or when
+    offscreen) the Agg backend is used, since animations can still be saved to a
+    file; otherwise TkAgg, as before, unless MPLBACKEND picks another backend."""
+    global matplotlib
+    if matplotlib is None:
+        import matplotlib as mpl
+        if offscreen or headless():
+            mpl.use('Agg')
+        elif not os.environ.get('MPLBACKEND'):
+            try:
+                import tkinter  # TkAgg needs it
+                mpl.use('TkAgg')
+            except ImportError:
+                pass
+        import matplotlib.pyplot
+        import matplotlib.patches
+        import matplotlib.animation
+        matplotlib = mpl
+    return matplotlib.pyplot
+
+
+NECTAR_RGB = (1.0, 0.65, 0.0)
+
+
+# ---------------------------
+# Frame data, computed once for the whole animation
+# ---------------------------
+def select_frames(n_frames, start=0, stop=None, every=1, max_frames=None):
+    # Frame decimation: every `every`-th frame of [start, stop), thinned further so
+    # that at most max_frames are drawn
+    frames = np.arange(n_frames)[start:stop:every]
+    if max_frames and len(frames) > max_frames:
+        frames = frames[np.linspace(0, len(frames) - 1, max_frames).round().astype(int)]
+    return frames
+
+
+def scene_info(env):
+    # What of env the frames are drawn against; small enough to send to render workers
+    return {'width': env.width, 'length': env.length, 'hive_position': tuple(env.hive_position),
+            'hive_radius': env.hive_radius, 'max_nec_strength': env.max_nec_strength}
+
+
+def frame_data(scene, history, frames, max_bees=None):
+    """Arrays for the given frames of history: bee positions (thinned to max_bees
+    evenly spaced bees for long, crowded histories), nectar alphas, the recorded
+    steps and the number of bees in the hive (counted over all bees). Frames are
+    read and thinned one at a time, so a Trajectory is never loaded whole."""
+    n_bees = len(history.frame(frames[0])[0]) if len(frames) else 0
+    sel = (np.linspace(0, n_bees - 1, max_bees).round().astype(int) if max_bees and n_bees > max_bees
+           else np.arange(n_bees))
+    n_nectars = len(history.nectar_positions)
+    positions = np.empty((len(frames), len(sel), 2))
+    alphas = np.empty((len(frames), n_nectars))
+    in_hive = np.empty(len(frames), dtype=np.int64)
+    hive = np.asarray(scene['hive_position'], dtype=float)
+    for k, i in enumerate(frames):
+        pos, _, strengths = history.frame(i)
+        offsets = np.asarray(pos, dtype=float) - hive
+        in_hive[k] = np.count_nonzero(np.einsum('bk,bk->b', offsets, offsets) <= scene['hive_radius'] ** 2)
+        positions[k] = pos[sel]
+        alphas[k] = np.clip(np.asarray(strengths) / scene['max_nec_strength'], 0, 1)
+    return {'frames': np.asarray(frames), 'steps': np.array([history.step(i) for i in frames], dtype=np.int64),
+            'positions': positions, 'alphas': alphas, 'in_hive': in_hive,
+            'nectar_positions': np.asarray(history.nectar_positions, dtype=float).reshape(-1, 2), 'scene': scene}
+
+
+def nectar_colors(alphas):
+    colors = np.empty((len(alphas), 4))
+    colors[:, :3] = NECTAR_RGB
+    colors[:, 3] = alphas
+    return colors
+
+
+def build_scene(plt, data):
+    # Figure with every artist created once; update(k) moves them to the k-th frame
+    # of data and returns the artists it changed, for blitting
+    scene = data['scene']
+    fig, ax = plt.subplots(1, 1)
+    ax.set_xlim(0, scene['length'])
+    ax.set_ylim(0, scene['width'])
+    ax.set_title('Bee swarm foraging')
+    ax.add_patch(matplotlib.patches.Circle(scene['hive_position'], radius=scene['hive_radius'],
+                                           facecolor='gold', edgecolor='black', label='Hive'))
+    nectar_scat = ax.scatter(data['nectar_positions'][:, 0], data['nectar_positions'][:, 1], marker='*', s=100,
+                             facecolors=nectar_colors(np.zeros(len(data['nectar_positions']))), animated=True)
+    bee_scat = ax.scatter([], [], color='black', s=50, animated=True)
+    status = ax.text(0.02, 0.97, '', transform=ax.transAxes, va='top', animated=True)
+
+    def update(k):
+        bee_scat.set_offsets(data['positions'][k])
+        nectar_scat.set_facecolors(nectar_colors(data['alphas'][k]))
+        status.set_text(f"Step {data['steps'][k]} - bees in hive: {data['in_hive'][k]}")
+        return [nectar_scat, bee_scat, status]
+
+    return fig, update
+
+
+def render_trajectory_segment(path, frames, scene, max_bees, filename, fps=30, dpi=100):
+    # Parallel rendering of a Trajectory on disk: each worker reads only its own frames
+    from history import Trajectory
+    return render_segment(frame_data(scene, Trajectory(path), frames, max_bees), filename, fps, dpi)
+
+
+def render_segment(data, filename, fps=30, dpi=100):
+    """Write the frames in data to filename; runs in its own process when rendering
+    in parallel. The static part of the figure is drawn once; each frame restores
+    it and draws only the artists that change, straight into the encoder."""
+    plt = pyplot(offscreen=True)
+    fig, update = build_scene(plt, data)
+    fig.set_dpi(dpi)
+    canvas = fig.canvas
+    canvas.draw()
+    background = canvas.copy_from_bbox(fig.bbox)
+    width, height = canvas.get_width_height()
+    with FrameSink(filename, fps, width, height) as sink:
+        for k in range(len(data['frames'])):
+            canvas.restore_region(background)
+            for artist in update(k):
+                artist.axes.draw_artist(artist)
+            sink.write(canvas.buffer_rgba())
+    plt.close(fig)
+    return filename
+
+
+class FrameSink:
+    """Encoder for RGBA frames: Pillow for .gif, an ffmpeg pipe for anything else."""
+
+    def __init__(self, filename, fps, width, height):
+        self.filename, self.fps, self.size = filename, fps, (width, height)
+        self.gif = filename.lower().endswith('.gif')
+        if self.gif:
+            self.frames = []
+        else:
+            ffmpeg = shutil.which('ffmpeg')
+            if ffmpeg is None:
+                raise ValueError(f'Saving {filename} needs ffmpeg; save a .gif instead')
+            self.proc = subprocess.Popen([ffmpeg, '-y', '-loglevel', 'error', '-f', 'rawvideo', '-pix_fmt', 'rgba',
+                                          '-s', f'{width}x{height}', '-r', str(fps), '-i', '-',
+                                          '-pix_fmt', 'yuv420p', filename], stdin=subprocess.PIPE)
+
+    def write(self, rgba):
+        if self.gif:
+            from PIL import Image
+            self.frames.append(Image.frombuffer('RGBA', self.size, bytes(rgba), 'raw', 'RGBA', 0, 1).convert('RGB'))
+        else:
+            self.proc.stdin.write(bytes(rgba))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        if self.gif:
+            if self.frames:
+                self.frames[0].save(self.filename, save_all=True, append_images=self.frames[1:],
+                                    duration=1000 / self.fps, loop=0)
+        else:
+            self.proc.stdin.close()
+            self.proc.wait()
+        return False
+
+
+def stitch(segments, filename, fps):
+    # Join rendered segments in order: ffmpeg's concat demuxer (no re-encoding) for
+    # videos, Pillow for GIFs
+    if filename.lower().endswith('.gif'):
+        from PIL import Image, ImageSequence
+        frames = []
+        for segment in segments:
+            with Image.open(segment) as im:
+                frames.extend(frame.copy() for frame in ImageSequence.Iterator(im))
+        frames[0].save(filename, save_all=True, append_images=frames[1:], duration=1000 / fps, loop=0)
+        return
+    with tempfile.NamedTemporaryFile('w', suffix='.txt', delete=False) as f:
+        f.writelines(f"file '{os.path.abspath(s)}'\n" for s in segments)
+    try:
+        subprocess.run([shutil.which('ffmpeg') or 'ffmpeg', '-y', '-loglevel', 'error', '-f', 'concat', '-safe', '0',
+                        '-i', f.name, '-c', 'copy', filename], check=True)
+    finally:
+        os.remove(f.name)
+
+
+def render(env, filename, fps=30, source=None, start=0, stop=None, every=1, max_frames=None, max_bees=2000,
+           n_jobs=1, dpi=100):
+    """Render a recorded history (env's own or source) to filename (.gif, or any
+    format ffmpeg writes). Frame arrays are computed once up front; with n_jobs > 1
+    contiguous frame ranges are rendered in worker processes and stitched. A
+    Trajectory on disk is read by the workers themselves, each loading only its
+    frame range; an in-memory history is sent to them one range at a time."""
+    history = env._replay_source(source)
+    scene = scene_info(env)
+    frames = select_frames(len(history), start, stop, every, max_frames)
+    if not filename.lower().endswith('.gif') and shutil.which('ffmpeg') is None:
+        raise ValueError(f'Saving {filename} needs ffmpeg; save a .gif instead')
+    n_jobs = max(1, min(n_jobs, len(frames)))
+    if n_jobs == 1:
+        return render_segment(frame_data(scene, history, frames, max_bees), filename, fps, dpi)
+
+    ext = os.path.splitext(filename)[1]
+    with tempfile.TemporaryDirectory() as tmp, ProcessPoolExecutor(max_workers=n_jobs) as executor:
+        futures = []
+        for j, part in enumerate(np.array_split(frames, n_jobs)):
+            segment = os.path.join(tmp, f'segment_{j:04d}{ext}')
+            if hasattr(history, 'path'):
+                futures.append(executor.submit(render_trajectory_segment, history.path, part, scene, max_bees,
+                                               segment, fps, dpi))
+            else:
+                futures.append(executor.submit(render_segment, frame_data(scene, history, part, max_bees),
+                                               segment, fps, dpi))
+        stitch([f.result() for f in futures], filename, fps)
+    return filename
+
+
+# ---------------------------
+# Entry points behind Environment.visualise and plot_grid
+# ---------------------------
+def visualise(env, fps=30, filename=None, source=None, every=1, max_frames=None, max_bees=2000, n_jobs=1):
+    # Saves the animation to filename if given (see render for the options), and
+    # shows it when there is a display, blitting only the artists that change
+    if filename:
+        render(env, filename, fps, source, every=every, max_frames=max_frames, max_bees=max_bees, n_jobs=n_jobs)
+    if headless():
+        return
+    plt = pyplot()
+    history = env._replay_source(source)
+    data = frame_data(scene_info(env), history, select_frames(len(history), every=every, max_frames=max_frames),
+                      max_bees)
+    fig, update = build_scene(plt, data)
+    ani = matplotlib.animation.FuncAnimation(fig, update, frames=len(data['frames']), interval=1000 / fps,
+                                             blit=True)
+    plt.show()
+    return ani
+
+
+def plot_grid(env, step, frame=None, source=None):
+    plt = pyplot()
+    # frame=None draws the live state, otherwise a recorded frame (from source if given)
+    if frame is None:
+        strengths = env.nectar_strengths()
+        nectar_positions = np.array([n['position'] for n in env.nectar_table], dtype=float).reshape(-1, 2)
+        bee_positions, bee_states = env.bee_snapshot()
+    else:
+        history = env._replay_source(source)
+        bee_positions, bee_states, strengths = history.frame(frame)
+        nectar_positions = history.nectar_positions
+    bee_positions = np.asarray(bee_positions, dtype=float).reshape(-1, 2)
+    strengths = np.asarray(strengths, dtype=float)
+
+    fig, ax = plt.subplots(1, 1)
+    ax.set_title(f'Bee swarm - step {step}' if step is not None else 'Bee swarm')
+    ax.set_xlim(0, env.length)
+    ax.set_ylim(0, env.width)
+
+    # One scatter call each for the remaining nectars and for the bees out of the hive
+    remaining = strengths > 0
+    ax.scatter(nectar_positions[remaining, 0], nectar_positions[remaining, 1], marker='*', s=100, label='Nectar',
+               facecolors=nectar_colors(np.clip(strengths[remaining] / env.max_nec_strength, 0, 1)))
+
+    hive_circle = matplotlib.patches.Circle(env.hive_position, radius=env.hive_radius,
+                                            facecolor='gold', edgecolor='black', label='Hive')
+    ax.add_patch(hive_circle)
+
+    away = ~np.isin(np.asarray(bee_states), [STATES.index('home'), STATES.index('dancing')])
+    ax.scatter(bee_positions[away, 0], bee_positions[away, 1], color='black', s=50)
+    if not headless():
+        plt.show()
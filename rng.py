@@ -0,0 +1,82 @@
+import numpy as np
+
+
+class RandomStream:
+    """Per-environment random source. Scalar uniform draws (the object engine asks
+    for one number at a time) are served from blocks pre-drawn in bulk from a numpy
+    Generator; calls with a size go straight to the Generator, so the vector engine
+    can share the same stream. The vector engine passes the replicate of every
+    draw as reps; a single stream serves all replicates, so it is ignored here
+    (see ReplicateStreams)."""
+
+    def __init__(self, seed=None, block=4096):
+        self.generator = np.random.default_rng(seed)
+        self.block = block
+        self._buffer = []
+        self._next = 0
+
+    def _uniform(self):
+        if self._next == len(self._buffer):
+            self._buffer = self.generator.random(self.block).tolist()
+            self._next = 0
+        u = self._buffer[self._next]
+        self._next += 1
+        return u
+
+    def random(self, size=None, reps=None):
+        if size is not None:
+            return self.generator.random(size)
+        return self._uniform()
+
+    def uniform(self, low=0.0, high=1.0, size=None, reps=None):
+        if size is not None:
+            return self.generator.uniform(low, high, size)
+        return low + (high - low) * self._uniform()
+
+    def integers(self, low, high=None, size=None):
+        if size is not None:
+            return self.generator.integers(low, high, size)
+        if high is None:
+            low, high = 0, low
+        return low + min(int(self._uniform() * (high - low)), high - low - 1)
+
+    def choice(self, seq):
+        return seq[self.integers(len(seq))]
+
+    def geometric(self, p, size=None):
+        return self.generator.geometric(p, size)
+
+    def vonmises(self, mu, kappa, size=None, reps=None):
+        # numpy's own sampler is already cheaper per scalar call than a rejection
+        # loop over buffered uniforms in Python, so this one is not buffered
+        return self.generator.vonmises(mu, kappa, size)
+
+
+class ReplicateStreams:
+    """Random source of a vector-engine ensemble: one Generator per replicate. Each
+    draw is made for an array reps of replicate ids, and every replicate's share
+    comes from its own generator, in order, so what a replicate draws (and hence its
+    result) does not depend on which other replicates are simulated alongside it."""
+
+    def __init__(self, generators):
+        self.generators = list(generators)
+
+    def _draw(self, reps, draw):
+        reps = np.asarray(reps, dtype=np.int64)
+        out = np.empty(len(reps))
+        if len(reps) == 0:
+            return out
+        order = np.argsort(reps, kind='stable')
+        for part in np.split(order, np.flatnonzero(np.diff(reps[order])) + 1):
+            out[part] = draw(self.generators[reps[part[0]]], part)
+        return out
+
+    def random(self, size=None, reps=None):
+        return self._draw(reps, lambda g, part: g.random(len(part)))
+
+    def uniform(self, low=0.0, high=1.0, size=None, reps=None):
+        return self._draw(reps, lambda g, part: g.uniform(low, high, len(part)))
+
+    def vonmises(self, mu, kappa, size=None, reps=None):
+        mu, kappa = np.asarray(mu), np.asarray(kappa)
+        return self._draw(reps, lambda g, part: g.vonmises(mu[part], kappa[part]))
@@ -1,16 +1,43 @@
+import itertools
+
 from classes import *
+from swarm import SwarmEnvironment, SwarmEnsemble
+from instrument import Profiler
+
 
+def build_environment(inpt, seed=None, engine='object', record='all', record_n=None, record_path=None):
+    num_scouts = int(inpt['num_bees'] * inpt['perc_scouts'])
+    if engine == 'vector':
+        env = SwarmEnvironment(inpt['width'], inpt['length'], inpt['hive_radius'], inpt['nectar_count'],
+                               inpt['max_nec_strength'], inpt['idle_prob'], inpt['follow_prob'],
+                               max_st=True, hive_pos='centre', seed=seed, record=record, record_n=record_n,
+                               record_path=record_path)
+        bee_params = (inpt['sense_range'], inpt['dt'], inpt['kappa_0'], inpt['alpha'], inpt['beta'], inpt['w_dir'])
+        env.add_bees(num_scouts, *bee_params, scout=True)
+        env.add_bees(inpt['num_bees'] - num_scouts, *bee_params, scout=False)
+        return env
+    elif engine != 'object':
+        raise ValueError(f'Not valid engine: {engine} should be "object" or "vector"')
 
-def run(inpt, vis=True, max_steps=False, seed=None):
     env = Environment(inpt['width'], inpt['length'], inpt['hive_radius'], inpt['nectar_count'],
                       inpt['max_nec_strength'], inpt['idle_prob'], inpt['follow_prob'],
-                      max_st=True, hive_pos='centre', seed=seed)
-    num_scouts = int(inpt['num_bees'] * inpt['perc_scouts'])
+                      max_st=True, hive_pos='centre', seed=seed, record=record, record_n=record_n,
+                      record_path=record_path)
     for i in range(inpt['num_bees']):
         sc = i < num_scouts
         b = Bee(env, inpt['sense_range'], inpt['dt'], inpt['kappa_0'], inpt['alpha'],
                 inpt['beta'], inpt['w_dir'], scout=sc)
         env.add_bee(b)
+    return env
+
+
+def run(inpt, vis=True, max_steps=False, seed=None, engine='object', record=None, record_n=None,
+        record_path=None, profile=False):
+    # Frames are only recorded when they will be shown or saved, unless a record mode is given.
+    # With profile=True the result also has a 'profile' dict (see instrument.Profiler)
+    record = record or ('all' if vis or record_path else 'off')
+    env = build_environment(inpt, seed, engine, record, record_n, record_path)
+    profiler = Profiler().attach(env) if profile else None
 
     # print(f'------------------------------------------------------')
     #     # f'\n------------------------------------------------------')
@@ -28,6 +55,8 @@ def run(inpt, vis=True, max_steps=False, seed=None):
         if max_steps and t >= inpt['max_steps']:
             break
 
+    env.history.flush()
+
     # Determine success
     success = len(env.nectars) == 0
     time = t if success else None
@@ -35,13 +64,48 @@ def run(inpt, vis=True, max_steps=False, seed=None):
     if vis:
         env.visualise()
 
-    return {
+    result = {
         'time_to_depletion': time,
         'total_nectar_collected': total,
         'time_to_first_nectar': time_first_nect,
         'success': success}
+    if profiler is not None:
+        result['profile'] = profiler.result()
+    return result
 
 
+def check_ensemble(engine, ensemble):
+    # Ensembles always run on the vector engine; asking for them with another engine is an error
+    if ensemble and engine != 'vector':
+        raise ValueError(f'ensemble runs use the vector engine; pass engine="vector" (got engine="{engine}")')
+
+
+def run_ensemble(inpts, max_steps=False, seeds=None, batch_size=None):
+    # Same records as run(), for many configs/replicates advanced together in one process.
+    # At most batch_size (default: all) run at once; each finished run is replaced by the
+    # next, whose environment is only built then
+    seeds = [None] * len(inpts) if seeds is None else list(seeds)
+    totals = []
+
+    def environments():
+        for inpt, seed in zip(inpts, seeds):
+            env = build_environment(inpt, seed, engine='vector', record='off')
+            totals.append(sum([nec['strength'] for nec in env.nectars]))
+            yield env
+
+    # Every replicate draws from its own seed's stream, so its result is that of
+    # run(..., engine='vector', seed=seed) whichever batch it is simulated in
+    envs = environments()
+    ensemble = SwarmEnsemble(itertools.islice(envs, batch_size or len(inpts)))
+    limits = [inpt['max_steps'] if max_steps else np.inf for inpt in inpts]
+    steps, first_dance, success = ensemble.run(limits, pending=envs)
+
+    return [{
+        'time_to_depletion': int(t) if ok else None,
+        'total_nectar_collected': total,
+        'time_to_first_nectar': int(first) if first >= 0 else None,
+        'success': bool(ok)} for t, total, first, ok in zip(steps, totals, first_dance, success)]
+
 
 if __name__ == '__main__':
     inp = {
@@ -65,5 +129,5 @@ if __name__ == '__main__':
         'w_dir': 1.0
     }
 
-    results = run(inp, vis=True, max_steps=True, seed=63)
+    results = run(inp, vis=True, max_steps=True, seed=63, engine='object')
     print(results)
@@ -0,0 +1,73 @@
+import math
+
+import numpy as np
+
+
+class NectarGrid:
+    """Uniform grid over nectar positions for the object engine. Nectars are bucketed
+    by cell so a bee only has to look at the cells its sense range overlaps."""
+
+    def __init__(self, cell_size, nectars=()):
+        self.cell_size = cell_size
+        self.cells = {}
+        for nec in nectars:
+            self.insert(nec)
+
+    def cell(self, position):
+        return int(position[0] // self.cell_size), int(position[1] // self.cell_size)
+
+    def insert(self, nec):
+        self.cells.setdefault(self.cell(nec['position']), {})[nec['id']] = nec
+
+    def remove(self, nec):
+        key = self.cell(nec['position'])
+        bucket = self.cells.get(key)
+        if bucket is not None:
+            bucket.pop(nec['id'], None)
+            if not bucket:
+                del self.cells[key]
+
+    def near(self, position, radius):
+        reach = math.ceil(radius / self.cell_size)
+        cx, cy = self.cell(position)
+        for i in range(cx - reach, cx + reach + 1):
+            for j in range(cy - reach, cy + reach + 1):
+                bucket = self.cells.get((i, j))
+                if bucket:
+                    yield from bucket.values()
+
+
+class PointGrid:
+    """Static uniform grid over an array of points for the vector engine, stored as
+    a sorted index with per-cell offsets so many queries can be answered at once."""
+
+    def __init__(self, points, cell_size):
+        self.cell_size = cell_size
+        points = np.asarray(points, dtype=float).reshape(-1, 2)
+        cells = np.floor(points / cell_size).astype(np.int64)
+        self.origin = cells.min(axis=0) if len(cells) else np.zeros(2, dtype=np.int64)
+        cells -= self.origin
+        self.shape = cells.max(axis=0) + 1 if len(cells) else np.ones(2, dtype=np.int64)
+        flat = cells[:, 0] * self.shape[1] + cells[:, 1]
+        self.order = np.argsort(flat, kind='stable')
+        self.starts = np.searchsorted(flat[self.order], np.arange(self.shape[0] * self.shape[1] + 1))
+
+    def pairs(self, points, radius):
+        """Candidate (query, point) index pairs whose cells lie within radius of each query."""
+        reach = math.ceil(radius / self.cell_size)
+        cells = np.floor(np.asarray(points) / self.cell_size).astype(np.int64) - self.origin
+        query, first, count = [], [], []
+        for di in range(-reach, reach + 1):
+            for dj in range(-reach, reach + 1):
+                ci, cj = cells[:, 0] + di, cells[:, 1] + dj
+                valid = np.flatnonzero((ci >= 0) & (ci < self.shape[0]) & (cj >= 0) & (cj < self.shape[1]))
+                flat = ci[valid] * self.shape[1] + cj[valid]
+                n = self.starts[flat + 1] - self.starts[flat]
+                keep = n > 0
+                query.append(valid[keep])
+                first.append(self.starts[flat[keep]])
+                count.append(n[keep])
+        query, first, count = np.concatenate(query), np.concatenate(first), np.concatenate(count)
+        total = count.sum()
+        offsets = np.arange(total) - np.repeat(np.cumsum(count) - count, count)
+        return np.repeat(query, count), self.order[np.repeat(first, count) + offsets]
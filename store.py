@@ -0,0 +1,125 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+try:
+    import pyarrow
+    import pyarrow.dataset
+    import pyarrow.parquet
+except ImportError:  # Parquet output is optional; the analysis falls back to the CSVs
+    pyarrow = None
+
+# Root of the columnar results store: one Parquet dataset per sweep under
+# STORE_ROOT/sweep=<name>/, partitioned further by e.g. p_name/q_name
+STORE_ROOT = 'results_store'
+
+# Rows per chunk when streaming a source
+CHUNK_ROWS = 500_000
+
+
+def parquet_available():
+    return pyarrow is not None
+
+
+def sweep_path(sweep, root=STORE_ROOT):
+    return os.path.join(root, f'sweep={sweep}')
+
+
+def write(df, sweep, partition_cols=(), root=STORE_ROOT):
+    """Write a sweep's results as a zstd-compressed Parquet dataset, replacing any
+    earlier one for that sweep. Parameters repeated on every row cost next to
+    nothing once dictionary- and run-length-encoded. Needs pyarrow."""
+    if pyarrow is None:
+        raise ImportError("Writing the Parquet results store needs pyarrow (pip install pyarrow)")
+    table = pyarrow.Table.from_pandas(df, preserve_index=False)
+    pyarrow.parquet.write_to_dataset(table, sweep_path(sweep, root), partition_cols=list(partition_cols) or None,
+                                     compression='zstd', existing_data_behavior='delete_matching')
+    return sweep_path(sweep, root)
+
+
+def write_table(df, outfile):
+    # A sweep's own output file: Parquet if outfile ends in .parquet (needs pyarrow), else CSV
+    if outfile.endswith('.parquet'):
+        if pyarrow is None:
+            raise ImportError(f"Writing {outfile} needs pyarrow (pip install pyarrow)")
+        pyarrow.parquet.write_table(pyarrow.Table.from_pandas(df, preserve_index=False), outfile,
+                                    compression='zstd')
+    else:
+        df.to_csv(outfile, index=False)
+
+
+def save(df, outfile, partition_cols=(), root=STORE_ROOT):
+    # Called by the sweep drivers after writing outfile: the sweep is named after it
+    if pyarrow is None:
+        print(f"pyarrow is not installed; {outfile} is not added to the Parquet store")
+        return None
+    path = write(df, sweep_name(outfile), partition_cols, root)
+    print(f"Saved results to {path}")
+    return path
+
+
+def sweep_name(outfile):
+    return os.path.splitext(os.path.basename(outfile))[0]
+
+
+def resolve(outfile, root=STORE_ROOT):
+    # The sweep's Parquet dataset when it exists and can be read, else its CSV
+    path = sweep_path(sweep_name(outfile), root)
+    return path if pyarrow is not None and os.path.isdir(path) else outfile
+
+
+def scan(source, columns=None, chunk_rows=CHUNK_ROWS):
+    """Yield a source as DataFrames of at most chunk_rows rows, reading only the
+    given columns. source is a Parquet dataset directory or a CSV file."""
+    if not source.endswith('.csv'):
+        dataset = pyarrow.dataset.dataset(source, format='parquet', partitioning='hive')
+        for batch in dataset.to_batches(columns=columns, batch_size=chunk_rows):
+            yield batch.to_pandas()
+    else:
+        yield from pd.read_csv(source, usecols=columns, chunksize=chunk_rows)
+
+
+def load(source, columns=None):
+    return pd.concat(scan(source, columns), ignore_index=True)
+
+
+def grouped_stats(chunks, keys, values):
+    """Count, mean and sample std of each column in values per group of keys,
+    accumulated chunk by chunk (Chan et al.'s parallel update), so only one chunk
+    and the per-group totals are ever in memory. NaNs are skipped, as in pandas."""
+    total = None
+    for chunk in chunks:
+        g = chunk.groupby(keys)[values]
+        # A group's mean and m2 are NaN where none of its values are set; as 0 they drop out below
+        part = pd.concat({'n': g.count(), 'mean': g.mean(), 'm2': g.var(ddof=0) * g.count()}, axis=1).fillna(0)
+        if total is None:
+            total = part
+            continue
+        total, part = total.align(part, fill_value=0)
+        for v in values:
+            n_a, n_b = total[('n', v)], part[('n', v)]
+            n = n_a + n_b
+            delta = part[('mean', v)] - total[('mean', v)]
+            frac = (n_b / n.where(n > 0)).fillna(0)
+            total[('m2', v)] += part[('m2', v)] + delta ** 2 * n_a * frac
+            total[('mean', v)] += delta * frac
+            total[('n', v)] = n
+    out = pd.DataFrame(index=total.index)
+    for v in values:
+        n = total[('n', v)]
+        out[f'{v}_count'] = n
+        out[f'{v}_mean'] = total[('mean', v)].where(n > 0)
+        out[f'{v}_std'] = np.sqrt(total[('m2', v)] / (n - 1)).where(n > 1)
+    return out.reset_index()
+
+
+def fastest_per_group(chunks, key, value):
+    """Row with the smallest value per group of key, over rows where value is set."""
+    best = None
+    for chunk in chunks:
+        chunk = chunk.dropna(subset=[value])
+        if best is not None:
+            chunk = pd.concat([best, chunk], ignore_index=True)
+        best = chunk.loc[chunk.groupby(key)[value].idxmin()]
+    return best.sort_values(key).reset_index(drop=True)
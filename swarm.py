@@ -0,0 +1,529 @@
+import numpy as np
+
+from classes import Environment, STATES
+from spatial import PointGrid
+from rng import RandomStream, ReplicateStreams
+from dances import dance_key
+
+HOME, SEARCHING, FOLLOWING, FOUND, RETURNING, DANCING = range(len(STATES))
+
+BEE_FIELDS = ('pos', 'state', 'scout', 'sense_range', 'dt', 'kappa_0', 'alpha', 'beta', 'w_dir', 'path_len',
+              'has_target', 'target_dir', 'target_dist', 'target_strength', 'dance', 'found_pick', 'known_pick',
+              'bee_rep')
+NECTAR_FIELDS = ('nec_pos', 'nec_strength', 'nec_active', 'nec_rep')
+DANCE_FIELDS = ('dance_dir', 'dance_dist', 'dance_strength', 'dance_alive', 'dance_rep', 'dance_seq')
+REP_FIELDS = ('rep_hive', 'rep_hive_radius', 'rep_size', 'rep_idle', 'rep_follow', 'rep_live')
+
+
+class Swarm:
+    """Struct-of-arrays swarm kernel: every bee, nectar and dance is a row in a set of
+    NumPy arrays tagged with the replicate it belongs to, and the whole swarm is
+    advanced per step with masked, vectorized state transitions. Bees of different
+    replicates never see each other's nectars or dances."""
+
+    def __init__(self, seed=None):
+        self.rng = RandomStream(seed)
+        self.pos = np.empty((0, 2))
+        self.state = np.empty(0, dtype=np.int8)
+        self.scout = np.empty(0, dtype=bool)
+        self.sense_range = np.empty(0)
+        self.dt = np.empty(0)
+        self.kappa_0 = np.empty(0)
+        self.alpha = np.empty(0)
+        self.beta = np.empty(0)
+        self.w_dir = np.empty(0)
+        self.path_len = np.empty(0, dtype=np.int64)
+        self.has_target = np.empty(0, dtype=bool)
+        self.target_dir = np.empty((0, 2))
+        self.target_dist = np.empty(0)
+        self.target_strength = np.empty(0)
+        self.dance = np.empty(0, dtype=np.int64)
+        self.found_pick = np.empty(0, dtype=np.int64)
+        self.known_pick = np.empty(0, dtype=np.int64)
+        self.bee_rep = np.empty(0, dtype=np.int64)
+
+        self.nec_pos = np.empty((0, 2))
+        self.nec_strength = np.empty(0, dtype=np.int64)
+        self.nec_active = np.empty(0, dtype=bool)
+        self.nec_rep = np.empty(0, dtype=np.int64)
+
+        self.dance_dir = np.empty((0, 2))
+        self.dance_dist = np.empty(0)
+        self.dance_strength = np.empty(0)
+        self.dance_alive = np.empty(0, dtype=bool)
+        self.dance_rep = np.empty(0, dtype=np.int64)
+        # Order in which dances were added: the live dances of a replicate are listed in
+        # this order whatever rows they were given, so picks do not depend on other replicates
+        self.dance_seq = np.empty(0, dtype=np.int64)
+        self.dance_count = 0
+        # (rep, dance_key) -> row of every live dance, and the rows free for reuse
+        self.dance_index = {}
+        self.dance_free = []
+
+        self.rep_hive = np.empty((0, 2))
+        self.rep_hive_radius = np.empty(0)
+        self.rep_size = np.empty((0, 2))
+        self.rep_idle = np.empty(0)
+        self.rep_follow = np.empty(0)
+        # Active nectars per replicate, kept up to date as nectars run dry
+        self.rep_live = np.empty(0, dtype=np.int64)
+        self.nectar_grid = None
+
+    # ---------------------------
+    # Storage
+    # ---------------------------
+    def _append(self, fields, values):
+        for name in fields:
+            current = getattr(self, name)
+            setattr(self, name, np.concatenate([current, np.asarray(values[name], dtype=current.dtype)]))
+
+    def _keep(self, fields, mask):
+        for name in fields:
+            setattr(self, name, getattr(self, name)[mask])
+
+    def add_replicate(self, width, length, hive_position, hive_radius, idle_prob, follow_prob, nectars=()):
+        rep = len(self.rep_hive)
+        self._append(REP_FIELDS, {'rep_hive': [hive_position], 'rep_hive_radius': [hive_radius],
+                                  'rep_size': [(width, length)], 'rep_idle': [idle_prob],
+                                  'rep_follow': [follow_prob], 'rep_live': [0]})
+        self.set_nectars(nectars, rep)
+        return rep
+
+    def set_nectars(self, nectars, rep=0):
+        self._keep(NECTAR_FIELDS, self.nec_rep != rep)
+        strength = np.array([n['strength'] for n in nectars], dtype=np.int64)
+        self._append(NECTAR_FIELDS, {'nec_pos': np.array([n['position'] for n in nectars]).reshape(-1, 2),
+                                     'nec_strength': strength, 'nec_active': strength > 0,
+                                     'nec_rep': np.full(len(nectars), rep)})
+        self.rep_live[rep] = np.count_nonzero(strength > 0)
+        self.nectar_grid = None
+
+    def add_bees(self, n, sense_range, dt, kappa_0, alpha, beta, w_dir, scout=False, rep=0):
+        self._append(BEE_FIELDS, {'pos': np.tile(self.rep_hive[rep], (n, 1)), 'state': np.full(n, HOME),
+                                  'scout': np.full(n, scout), 'sense_range': np.full(n, sense_range),
+                                  'dt': np.full(n, dt), 'kappa_0': np.full(n, kappa_0), 'alpha': np.full(n, alpha),
+                                  'beta': np.full(n, beta), 'w_dir': np.full(n, w_dir), 'path_len': np.ones(n),
+                                  'has_target': np.zeros(n), 'target_dir': np.zeros((n, 2)),
+                                  'target_dist': np.zeros(n), 'target_strength': np.zeros(n),
+                                  'dance': np.zeros(n), 'found_pick': np.full(n, -1), 'known_pick': np.full(n, -1),
+                                  'bee_rep': np.full(n, rep)})
+
+    def extend(self, other):
+        """Append all replicates of another swarm; returns their new replicate ids."""
+        offset, nec_offset = len(self.rep_hive), len(self.nec_pos)
+        self._append(REP_FIELDS, {name: getattr(other, name) for name in REP_FIELDS})
+        self._append(NECTAR_FIELDS, {**{name: getattr(other, name) for name in NECTAR_FIELDS},
+                                     'nec_rep': other.nec_rep + offset})
+        alive = other.dance_alive
+        self._append(DANCE_FIELDS, {**{name: getattr(other, name)[alive] for name in DANCE_FIELDS},
+                                    'dance_rep': other.dance_rep[alive] + offset})
+        self.dance_count = max(self.dance_count, other.dance_count)
+        picks = {name: np.where(getattr(other, name) >= 0, getattr(other, name) + nec_offset, -1)
+                 for name in ('found_pick', 'known_pick')}
+        self._append(BEE_FIELDS, {**{name: getattr(other, name) for name in BEE_FIELDS}, **picks,
+                                  'bee_rep': other.bee_rep + offset})
+        self._index_dances()
+        self.nectar_grid = None
+        return np.arange(offset, len(self.rep_hive))
+
+    def drop_replicates(self, reps):
+        """Remove the bees, nectars and dances of finished replicates from the active arrays."""
+        self._keep(BEE_FIELDS, ~np.isin(self.bee_rep, reps))
+        keep = ~np.isin(self.nec_rep, reps)
+        new_index = np.cumsum(keep) - 1
+        self._keep(NECTAR_FIELDS, keep)
+        for picks in (self.found_pick, self.known_pick):
+            valid = picks >= 0
+            picks[valid] = new_index[picks[valid]]
+        self.dance_alive &= ~np.isin(self.dance_rep, reps)
+        self._index_dances()
+        self.nectar_grid = None
+
+    def nectars_left(self):
+        return self.rep_live
+
+    def dances_alive(self):
+        return np.bincount(self.dance_rep[self.dance_alive], minlength=len(self.rep_hive))
+
+    # ---------------------------
+    # Dances
+    # ---------------------------
+    def _index_dances(self):
+        alive = np.flatnonzero(self.dance_alive)
+        self.dance_index = {(int(self.dance_rep[i]),) + dance_key(self.dance_dir[i], self.dance_dist[i]): int(i)
+                            for i in alive}
+        self.dance_free = np.flatnonzero(~self.dance_alive)[::-1].tolist()
+
+    def add_dance(self, direction, distance, strength, rep=0):
+        """Add a dance unless the replicate already has one for the same (direction,
+        distance), keyed as in DanceBoard; returns whether it was added."""
+        key = (int(rep),) + dance_key(direction, distance)
+        if key in self.dance_index:
+            return False
+        if not self.dance_free:
+            grow = max(8, len(self.dance_alive))
+            self._append(DANCE_FIELDS, {'dance_dir': np.zeros((grow, 2)), 'dance_dist': np.zeros(grow),
+                                        'dance_strength': np.zeros(grow), 'dance_alive': np.zeros(grow),
+                                        'dance_rep': np.zeros(grow), 'dance_seq': np.zeros(grow)})
+            self.dance_free = list(range(len(self.dance_alive) - 1, len(self.dance_alive) - grow - 1, -1))
+        i = self.dance_free.pop()
+        self.dance_dir[i] = direction
+        self.dance_dist[i] = distance
+        self.dance_strength[i] = strength
+        self.dance_alive[i] = True
+        self.dance_rep[i] = rep
+        self.dance_seq[i] = self.dance_count
+        self.dance_count += 1
+        self.dance_index[key] = i
+        return True
+
+    def remove_dance(self, direction, distance, rep=0):
+        i = self.dance_index.pop((int(rep),) + dance_key(direction, distance), None)
+        if i is None:
+            return False
+        self.dance_alive[i] = False
+        self.dance_free.append(i)
+        return True
+
+    def _pick_dances(self, idx):
+        # Uniform choice among the live dances of each bee's own replicate
+        if len(idx) == 0:
+            return
+        alive = np.flatnonzero(self.dance_alive)
+        alive = alive[np.lexsort((self.dance_seq[alive], self.dance_rep[alive]))]
+        counts = np.bincount(self.dance_rep[alive], minlength=len(self.rep_hive))
+        starts = np.cumsum(counts) - counts
+        rep = self.bee_rep[idx]
+        picks = alive[starts[rep] + (self.rng.random(len(idx), reps=rep) * counts[rep]).astype(np.int64)]
+        self.has_target[idx] = True
+        self.target_dir[idx] = self.dance_dir[picks]
+        self.target_dist[idx] = self.dance_dist[picks]
+        self.target_strength[idx] = self.dance_strength[picks]
+
+    # ---------------------------
+    # Vectorized behaviour
+    # ---------------------------
+    def _grid_positions(self, positions, reps):
+        # Replicates are laid side by side along x so one grid serves them all
+        stride = self.rep_size.max() + 4 * self.sense_range.max()
+        return positions + np.column_stack([reps * stride, np.zeros(len(reps))])
+
+    def sense(self, idx):
+        """Sense nectars for bees idx; returns a mask of bees that found something and
+        stores one uniformly chosen hit for the found and home states respectively."""
+        found = np.zeros(len(idx), dtype=bool)
+        if len(idx) == 0 or not self.rep_live.any():
+            return found
+        if self.nectar_grid is None:
+            self.nectar_grid = PointGrid(self._grid_positions(self.nec_pos, self.nec_rep), self.sense_range.max())
+        radius = self.sense_range[idx]
+        bee, nec = self.nectar_grid.pairs(self._grid_positions(self.pos[idx], self.bee_rep[idx]), radius.max())
+        dist = np.linalg.norm(self.nec_pos[nec] - self.pos[idx[bee]], axis=1)
+        hit = self.nec_active[nec] & (self.nec_rep[nec] == self.bee_rep[idx[bee]]) & (dist <= radius[bee])
+        bee, nec = bee[hit], nec[hit]
+        if len(bee) == 0:
+            return found
+        found[bee] = True
+        # Random keys are handed out in (bee, nectar) order, not in the order the grid
+        # yields the pairs, which depends on the other replicates in the grid
+        canonical = np.lexsort((nec, bee))
+        keys = np.empty(len(bee))
+        for picks in (self.found_pick, self.known_pick):
+            # Last entry per bee after sorting by (bee, random key) is a uniform pick
+            keys[canonical] = self.rng.random(len(bee), reps=self.bee_rep[idx[bee[canonical]]])
+            order = np.lexsort((keys, bee))
+            last = np.append(bee[order][1:] != bee[order][:-1], True)
+            picks[idx[bee[order][last]]] = nec[order][last]
+        return found
+
+    def move_straight(self, idx):
+        if len(idx) == 0:
+            return
+        step = self.dt[idx, None] * self.target_dir[idx]
+        self._step_to(idx, self.pos[idx] + step)
+
+    def move_random(self, idx):
+        if len(idx) == 0:
+            return
+        pos = self.pos[idx]
+        width, length = self.rep_size[self.bee_rep[idx]].T
+        from_hive = pos - self.rep_hive[self.bee_rep[idx]]
+        dist_from_hive = np.linalg.norm(from_hive, axis=1)
+        direction = np.where((self.path_len[idx] < 2)[:, None], from_hive, 0.0)
+        direction = _normalise(direction)
+
+        margin = self.sense_range[idx]
+        repulsion = np.zeros_like(pos)
+        repulsion[:, 0] = np.where(pos[:, 0] < margin, 1, np.where(pos[:, 0] > length - margin, -1, 0))
+        repulsion[:, 1] = np.where(pos[:, 1] < margin, 1, np.where(pos[:, 1] > width - margin, -1, 0))
+        repulsion = _normalise(repulsion)
+
+        w_dir = self.w_dir[idx, None]
+        combined = w_dir * direction + (1 - w_dir) * repulsion
+        # Von Mises noise around a uniformly random preferred angle is itself uniform,
+        # so only bees with an informative heading need a von Mises draw
+        angle = self.rng.uniform(0, 2 * np.pi, size=len(idx), reps=self.bee_rep[idx])
+        steered = np.flatnonzero(np.linalg.norm(combined, axis=1) > 0)
+        if len(steered):
+            pref_angle = np.arctan2(combined[steered, 1], combined[steered, 0])
+            b = idx[steered]
+            kappa = self.kappa_0[b] + self.alpha[b] * np.exp(-dist_from_hive[steered] / self.beta[b])
+            angle[steered] = self.rng.vonmises(pref_angle, kappa, reps=self.bee_rep[b])
+        step = self.dt[idx, None] * np.column_stack([np.cos(angle), np.sin(angle)])
+        self._step_to(idx, pos + step)
+
+    def _step_to(self, idx, new_pos):
+        # Clipped against (width, length) like Bee.move
+        width, length = self.rep_size[self.bee_rep[idx]].T
+        new_pos[:, 0] = np.clip(new_pos[:, 0], 0, width)
+        new_pos[:, 1] = np.clip(new_pos[:, 1], 0, length)
+        self.pos[idx] = new_pos
+        self.path_len[idx] += 1
+
+    def _arrive_home(self, idx):
+        self.state[idx] = HOME
+        self.pos[idx] = self.rep_hive[self.bee_rep[idx]]
+        self.path_len[idx] = 0
+
+    def _leave(self, idx):
+        self.state[idx] = np.where(self.scout[idx], SEARCHING, RETURNING)
+        self.has_target[idx] = False
+
+    def step(self):
+        # All bees act on the world as it was at the start of the step
+        state = self.state
+        hive = self.rep_hive[self.bee_rep]
+        dist_to_hive = np.linalg.norm(self.pos - hive, axis=1)
+        in_hive = dist_to_hive <= self.rep_hive_radius[self.bee_rep]
+        has_dance = (self.dances_alive() > 0)[self.bee_rep]
+
+        following = state == FOLLOWING
+        fresh = np.flatnonzero(following & ~self.has_target)
+        led = np.flatnonzero(following & self.has_target)
+        searching = np.flatnonzero(state == SEARCHING)
+        home = state == HOME
+        knows = np.flatnonzero(home & (self.known_pick >= 0))
+        targeted = np.flatnonzero(home & (self.known_pick < 0) & self.has_target)
+        idle = np.flatnonzero(home & (self.known_pick < 0) & ~self.has_target)
+        found = np.flatnonzero(state == FOUND)
+        returning = np.flatnonzero(state == RETURNING)
+        dancing = np.flatnonzero(state == DANCING)
+
+        # --- following ---
+        self._leave(fresh[~has_dance[fresh]])
+        fresh = fresh[has_dance[fresh]]
+        self._pick_dances(fresh)
+        sensed = self.sense(fresh)
+        state[fresh[sensed]] = FOUND
+        self.has_target[fresh[sensed]] = False
+        self.move_straight(fresh[~sensed])
+
+        sensed = self.sense(led)
+        state[led[sensed]] = FOUND
+        self.has_target[led[sensed]] = False
+        led = led[~sensed]
+        done = dist_to_hive[led] >= self.target_dist[led] - self.sense_range[led]
+        self._leave(led[done])
+        self.move_straight(led[~done])
+
+        # --- searching ---
+        sensed = self.sense(searching)
+        state[searching[sensed]] = FOUND
+        searching = searching[~sensed]
+        recruit = in_hive[searching] & has_dance[searching]
+        state[searching[recruit]] = FOLLOWING
+        self._pick_dances(searching[recruit])
+        self.move_random(searching[~recruit])
+
+        # --- home ---
+        for i in knows:
+            nec, rep = self.known_pick[i], self.bee_rep[i]
+            vector = self.nec_pos[nec] - self.pos[i]
+            distance = np.linalg.norm(vector)
+            direction = vector / distance
+            self.known_pick[i] = -1
+            strength = self.nec_strength[nec]
+            if self.add_dance(direction, distance, strength, rep):
+                state[i] = DANCING
+                self.has_target[i] = True
+                self.target_dir[i] = direction
+                self.target_dist[i] = distance
+                self.target_strength[i] = strength
+                self.dance[i] = 1
+        state[targeted] = FOLLOWING
+        leaves = self.scout[idle] & (self.rng.random(len(idle), reps=self.bee_rep[idle]) >
+                                     self.rep_idle[self.bee_rep[idle]])
+        state[idle[leaves]] = SEARCHING
+        idle = idle[~leaves & has_dance[idle]]
+        recruited = idle[self.rng.random(len(idle), reps=self.bee_rep[idle]) < self.rep_follow[self.bee_rep[idle]]]
+        state[recruited] = FOLLOWING
+        self._pick_dances(recruited)
+
+        # --- found ---
+        np.subtract.at(self.nec_strength, self.found_pick[found], 1)
+        self._arrive_home(found[in_hive[found]])
+        state[found[~in_hive[found]]] = RETURNING
+
+        # --- returning ---
+        self._arrive_home(returning[in_hive[returning]])
+        returning = returning[~in_hive[returning]]
+        to_home = hive[returning] - self.pos[returning]
+        self.pos[returning] += self.dt[returning, None] * to_home / dist_to_hive[returning, None]
+        self.path_len[returning] += 1
+
+        # --- dancing ---
+        finished = self.dance[dancing] > self.target_strength[dancing]
+        for i in dancing[finished]:
+            self.remove_dance(self.target_dir[i], self.target_dist[i], self.bee_rep[i])
+        state[dancing[finished]] = HOME
+        self.dance[dancing[finished]] = 0
+        self.dance[dancing[~finished]] += 1
+
+        # Only nectars visited this step can have run dry
+        visited = np.unique(self.found_pick[found])
+        dry = visited[self.nec_active[visited] & (self.nec_strength[visited] <= 0)]
+        self.nec_active[dry] = False
+        np.subtract.at(self.rep_live, self.nec_rep[dry], 1)
+
+
+class SwarmEnvironment(Swarm, Environment):
+    """Single-replicate swarm behind the Environment API. Bees are added with
+    add_bees(); update, nectars, dances, history and visualise behave as for the
+    object engine."""
+
+    def __init__(self, width, length, hive_radius, nectar_count, max_nec_strength, idle_prob, follow_prob,
+                 max_st, hive_pos, seed=None, record='all', record_n=None, record_path=None):
+        Swarm.__init__(self, seed)
+        Environment.__init__(self, width, length, hive_radius, nectar_count, max_nec_strength, idle_prob,
+                             follow_prob, max_st, hive_pos, seed, record, record_n, record_path)
+        self.add_replicate(width, length, self.hive_position, hive_radius, idle_prob, follow_prob, self.nectar_table)
+
+    @property
+    def nectars(self):
+        return SwarmNectars(self)
+
+    @nectars.setter
+    def nectars(self, nectars):
+        # Nectars are placed before the hive exists; the replicate is created from
+        # nectar_table once it does
+        if len(self.rep_hive):
+            self.set_nectars(nectars)
+
+    @property
+    def dances(self):
+        return [{'direction': tuple(self.dance_dir[i]), 'distance': self.dance_dist[i],
+                 'strength': self.dance_strength[i]} for i in np.flatnonzero(self.dance_alive)]
+
+    @dances.setter
+    def dances(self, dances):
+        self.dance_alive[:] = False
+        self._index_dances()
+        for d in dances:
+            self.add_dance(d['direction'], d['distance'], d['strength'])
+
+    def add_bee(self, bee):
+        self.add_bees(1, bee.sense_range, bee.dt, bee.kappa_0, bee.alpha, bee.beta, bee.w_dir, scout=bee.scout)
+
+    def bee_snapshot(self):
+        return self.pos, self.state
+
+    def nectar_strengths(self):
+        return self.nec_strength
+
+    def update(self):
+        self.step()
+        self.t += 1
+        self.record_state()
+
+
+class SwarmEnsemble(Swarm):
+    """Many independent replicates advanced together. Replicates are taken from
+    already-built SwarmEnvironments and drop out of the arrays once finished. Each
+    replicate keeps drawing from its environment's own random stream, so it runs
+    exactly as that environment would on its own, whatever else is in the batch
+    and whenever it joins it."""
+
+    def __init__(self, environments=()):
+        super().__init__()
+        self.rng = ReplicateStreams([])
+        for env in environments:
+            self.add(env)
+
+    def add(self, env):
+        """Append a single-replicate SwarmEnvironment; returns its replicate id."""
+        rep, = self.extend(env)
+        self.rng.generators.append(env.rng.generator)
+        return rep
+
+    def run(self, max_steps=None, pending=()):
+        """Step until every replicate, those in pending included, has run out of
+        nectar or hit its max_steps. pending yields further environments (e.g. built
+        on demand): each replicate that finishes is replaced by the next of them, so
+        the batch stays as large as it started until pending runs out, instead of
+        stepping a shrinking tail of slow replicates. max_steps has one limit per
+        replicate in the order added. Returns per-replicate arrays of steps taken,
+        first-dance step (-1 if none) and success, each counted from the step the
+        replicate joined."""
+        pending = iter(pending)
+        limits = None if max_steps is None else np.asarray(max_steps, dtype=float)
+        n = len(self.rep_hive)
+        start = np.zeros(n, dtype=np.int64)
+        steps = np.zeros(n, dtype=np.int64)
+        first_dance = np.full(n, -1, dtype=np.int64)
+        success = self.nectars_left() == 0
+        live = ~success
+        self.drop_replicates(np.flatnonzero(success))
+        free = n - int(live.sum())
+        t = 0
+        while True:
+            while free:
+                env = next(pending, None)
+                if env is None:
+                    break
+                rep = self.add(env)
+                done = self.nectars_left()[rep] == 0
+                start, steps, first_dance = np.append(start, t), np.append(steps, 0), np.append(first_dance, -1)
+                success, live = np.append(success, done), np.append(live, not done)
+                if done:
+                    self.drop_replicates([rep])
+                else:
+                    free -= 1
+            if not live.any():
+                break
+            self.step()
+            t += 1
+            age = t - start
+            limit = np.inf if limits is None else limits[:len(age)]
+            danced = live & (first_dance < 0) & (self.dances_alive() > 0)
+            first_dance[danced] = age[danced]
+            left = self.nectars_left()
+            finished = live & ((left == 0) | (age >= limit))
+            success[finished] = left[finished] == 0
+            steps[finished] = age[finished]
+            live &= ~finished
+            if finished.any():
+                self.drop_replicates(np.flatnonzero(finished))
+                free += int(finished.sum())
+        return steps, first_dance, success
+
+
+class SwarmNectars:
+    """NectarTable-like view of a single-replicate swarm's nectars: len() and
+    iteration cover active nectars, view[id] reads any nectar."""
+
+    def __init__(self, swarm):
+        self.swarm = swarm
+
+    def __len__(self):
+        return int(self.swarm.rep_live[0])
+
+    def __iter__(self):
+        return (self[i] for i in np.flatnonzero(self.swarm.nec_active))
+
+    def __getitem__(self, nid):
+        return {'id': int(nid), 'position': tuple(self.swarm.nec_pos[nid]), 'strength': self.swarm.nec_strength[nid]}
+
+
+def _normalise(vectors):
+    norm = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return np.divide(vectors, norm, out=np.zeros_like(vectors), where=norm > 0)
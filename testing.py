@@ -1,13 +1,18 @@
 import itertools
+from functools import partial
 import numpy as np
 import pandas as pd
 from tqdm import tqdm
-import matplotlib.pyplot as plt
-import seaborn as sns
 from multiprocessing import Pool, cpu_count
 
 from classes import *
-from run import run  # your modified run() with fixed hive
+from run import run, run_ensemble, check_ensemble  # your modified run() with fixed hive
+from checkpoint import Checkpoint
+from render import pyplot
+from cache import ResultCache, CACHE_PATH
+from aggregate import SweepSummary
+from experiment import chunk_size
+import store
 
 # ==== DEFAULT PARAMETERS ====
 default_params = {
@@ -43,13 +48,20 @@ param_ranges = {
 params_of_interest = list(param_ranges.keys())
 pairs = list(itertools.combinations(params_of_interest, 2))
 
+# Task identity in the .partial checkpoint; these columns are dropped from the final CSV
+CHECKPOINT_FIELDS = ('p_name', 'q_name', 'p_val', 'q_val', 'rep', 'seed', 'engine')
+
+def sim_seed(rep):
+    return 63 + rep
+
 # ==== SINGLE SIMULATION ====
-def run_single_sim(params, p_name, q_name, p_val, q_val, rep):
+def sim_params(params, p_name, q_name, p_val, q_val):
     params_copy = params.copy()
     params_copy[p_name] = float(p_val)
     params_copy[q_name] = float(q_val)
-    out = run(params_copy, vis=False, max_steps=True, seed=63)
+    return params_copy
 
+def sim_record(out, params, p_name, q_name, p_val, q_val, rep):
     # Fill ALL parameters explicitly
     for k, v in params.items():
         if k not in out:
@@ -61,28 +73,139 @@ def run_single_sim(params, p_name, q_name, p_val, q_val, rep):
     out["rep"] = rep
     return out
 
-# Wrapper for multiprocessing
-def run_single_sim_wrapper(args):
-    return run_single_sim(*args)
+def run_single_sim(params, p_name, q_name, p_val, q_val, rep, cache=None, profile=False, engine='object'):
+    # Seeds are now honoured by run(), so each replicate gets its own. The default point
+    # recurs in every pair's grid, so with a ResultCache it is only simulated once per seed.
+    # Profiled runs always simulate, and their record carries the run's 'profile'
+    sim = sim_params(params, p_name, q_name, p_val, q_val)
+    simulate = lambda: run(sim, vis=False, max_steps=True, seed=sim_seed(rep), engine=engine, profile=profile)
+    out = simulate() if cache is None or profile else cache.cached(simulate, sim, sim_seed(rep), engine)
+    return sim_record(out, params, p_name, q_name, p_val, q_val, rep)
+
+# Ensemble version: run_single_sim tasks advance together, batch_size of them at a time
+def run_sim_batch(tasks, batch_size=None):
+    outs = run_ensemble([sim_params(*task[:5]) for task in tasks], max_steps=True,
+                        seeds=[sim_seed(task[5]) for task in tasks], batch_size=batch_size)
+    return [sim_record(out, *task) for out, task in zip(outs, tasks)]
+
+# ==== WORKERS ====
+# Base parameters of the sweep, loaded once per worker process by init_worker so
+# that tasks only carry (p_name, q_name, p_val, q_val, rep), and the worker's result cache
+_worker_params = None
+_worker_cache = None
+
+def init_worker(params, cache_path=None):
+    global _worker_params, _worker_cache
+    _worker_params = params
+    _worker_cache = ResultCache(cache_path) if cache_path else None
+
+def run_sim_chunk(chunk, engine='object', ensemble=None, profile=False):
+    # Runs a chunk of tasks in one worker; returns (p_name, q_name, record) per task.
+    # Ensembles are not profiled
+    check_ensemble(engine, ensemble)
+    tasks = [(_worker_params, *task) for task in chunk]
+    if ensemble:
+        outs = run_sim_batch(tasks, ensemble)
+    else:
+        outs = [run_single_sim(*task, _worker_cache, profile, engine) for task in tasks]
+    return [(p_name, q_name, out) for (p_name, q_name, *_), out in zip(chunk, outs)]
+
+def make_pool(params=default_params, cache=CACHE_PATH):
+    # cache: path of the ResultCache used by the workers, or None to always simulate
+    return Pool(processes=cpu_count(), initializer=init_worker, initargs=(params, cache))
 
 # ==== PARALLEL GRID RUN ====
-def run_grid_parallel(p_name, q_name, n_reps=5):
-    results = []
-    tasks = [(default_params, p_name, q_name, p_val, q_val, rep)
+def run_pairs_parallel(pairs, n_reps=5, engine='object', ensemble=None, checkpoint=None, pool=None, chunksize=None, profiles=None,
+                       summary=None, keep_records=True):
+    # Sweeps every (p_name, q_name) pair through one pool, so workers never drain
+    # between pairs; returns {(p_name, q_name): DataFrame}. A pool passed in must come
+    # from make_pool. With a Checkpoint, tasks already recorded in it are skipped and
+    # every finished record is added to it (tagged with CHECKPOINT_FIELDS) as soon as
+    # it completes. Given an instrument.ProfileAggregator as profiles, runs are
+    # profiled and their profiles collected in it per worker.
+    # Given a SweepSummary (see grid_summary), every record updates it as it arrives;
+    # with keep_records=False (and no checkpoint) records are then not kept at all and
+    # the returned DataFrames are empty. ensemble needs engine='vector'
+    check_ensemble(engine, ensemble)
+    tasks = [(p_name, q_name, p_val, q_val, rep)
+             for p_name, q_name in pairs
              for p_val in param_ranges[p_name]
              for q_val in param_ranges[q_name]
              for rep in range(n_reps)]
+    results = {pair: [] for pair in pairs}
+    if checkpoint is not None:
+        def task_key(p_name, q_name, p_val, q_val, rep):
+            return checkpoint.key(dict(zip(CHECKPOINT_FIELDS, (p_name, q_name, p_val, q_val, rep, sim_seed(rep),
+                                                               engine))))
+        keys = {task_key(*task) for task in tasks}
+        tasks = [task for task in tasks if task_key(*task) not in checkpoint.done]
+        if summary is not None:
+            for rec in checkpoint.records:
+                if checkpoint.key(rec) in keys:
+                    summary.add(rec)
 
-    with Pool(processes=cpu_count()) as pool:
-        for out in tqdm(pool.imap_unordered(run_single_sim_wrapper, tasks),
-                        total=len(tasks),
-                        desc=f"Sweeping {p_name} vs {q_name}",
-                        ncols=100):
-            results.append(out)
+    own_pool = pool is None
+    if own_pool:
+        pool = make_pool()
+    size = chunksize or chunk_size(len(tasks), cpu_count(), ensemble)
+    chunks = [tasks[b:b + size] for b in range(0, len(tasks), size)]
+    desc = f"Sweeping {pairs[0][0]} vs {pairs[0][1]}" if len(pairs) == 1 else f"Sweeping {len(pairs)} pairs"
+    try:
+        with tqdm(total=len(tasks), desc=desc, ncols=100) as pbar:
+            for outs in pool.imap_unordered(partial(run_sim_chunk, engine=engine, ensemble=ensemble,
+                                                    profile=profiles is not None),
+                                            chunks):
+                for p_name, q_name, out in outs:
+                    if 'profile' in out:
+                        profiles.add(out.pop('profile'))
+                    if summary is not None:
+                        summary.add({**out, 'p_name': p_name, 'q_name': q_name, 'p_val': out[p_name],
+                                     'q_val': out[q_name]})
+                    if checkpoint is not None:
+                        checkpoint.add({**out, 'p_name': p_name, 'q_name': q_name, 'p_val': out[p_name],
+                                        'q_val': out[q_name], 'seed': sim_seed(out['rep']), 'engine': engine})
+                    elif keep_records:
+                        results[p_name, q_name].append(out)
+                pbar.update(len(outs))
+    finally:
+        if own_pool:
+            pool.close()
+            pool.join()
 
-    return pd.DataFrame(results)
+    if checkpoint is not None:
+        for rec in checkpoint.records:
+            if checkpoint.key(rec) in keys:
+                results[rec['p_name'], rec['q_name']].append(rec)
+        return {pair: pd.DataFrame(recs).drop(columns=[f for f in CHECKPOINT_FIELDS if f != 'rep'])
+                for pair, recs in results.items()}
+    return {pair: pd.DataFrame(recs) for pair, recs in results.items()}
+
+def run_grid_parallel(p_name, q_name, n_reps=5, engine='object', ensemble=None, checkpoint=None, pool=None,
+                      profiles=None):
+    return run_pairs_parallel([(p_name, q_name)], n_reps, engine, ensemble, checkpoint, pool,
+                              profiles=profiles)[p_name, q_name]
 
 # ==== SUMMARIZE RESULTS ====
+def grid_summary():
+    # Running per-cell summary for run_pairs_parallel(summary=...)
+    return SweepSummary(('p_name', 'q_name', 'p_val', 'q_val'))
+
+def summary_pivots(summary_df, p_name, q_name):
+    # summarize_grid's three tables from a SweepSummary frame instead of raw records
+    df = summary_df[(summary_df['p_name'] == p_name) & (summary_df['q_name'] == q_name)]
+    p_vals = param_ranges[p_name]
+    q_vals = param_ranges[q_name]
+
+    def pivot(values):
+        return df.pivot(index='q_val', columns='p_val', values=values).reindex(index=q_vals, columns=p_vals)
+
+    # Cells without a successful run have no time statistics and are left NaN
+    success, mean_time, std_time = (pivot(v) for v in ('success_rate', 'time_to_depletion_mean',
+                                                        'time_to_depletion_std'))
+    for table in (success, mean_time, std_time):
+        table.index.name, table.columns.name = q_name, p_name
+    return success, mean_time, std_time
+
 def summarize_grid(df, p_name, q_name):
     p_vals = param_ranges[p_name]
     q_vals = param_ranges[q_name]
@@ -114,7 +237,9 @@ def summarize_grid(df, p_name, q_name):
 
 # ==== PLOTTING ====
 def create_heatmap(pivot, p_name, q_name, title, cmap="viridis"):
-    fig, ax = plt.subplots(figsize=(7, 6))
+    # Plotting libraries are only loaded here, so pool workers never import them
+    import seaborn as sns
+    fig, ax = pyplot().subplots(figsize=(7, 6))
     sns.heatmap(pivot, annot=True, fmt=".2f", cmap=cmap, ax=ax)
     ax.set_xticklabels([f"{x:.2f}" for x in pivot.columns], rotation=45)
     ax.set_yticklabels([f"{y:.2f}" for y in pivot.index], rotation=0)
@@ -128,19 +253,25 @@ if __name__ == "__main__":
     all_results = []
     all_figures = []
 
-    for p_name, q_name in tqdm(pairs, desc="All parameter pairs", ncols=100):
-        df = run_grid_parallel(p_name, q_name, n_reps=5)
-        all_results.append(df)
+    # An interrupted sweep picks up from pairwise_sensitivity_results.csv.partial
+    with Checkpoint("pairwise_sensitivity_results.csv", CHECKPOINT_FIELDS) as checkpoint:
+        # All pairs share one pool and one task queue
+        results = run_pairs_parallel(pairs, n_reps=5, checkpoint=checkpoint)
+        for p_name, q_name in pairs:
+            df = results[p_name, q_name]
+            all_results.append(df.assign(p_name=p_name, q_name=q_name))
 
-        success, mean_time, std_time = summarize_grid(df, p_name, q_name)
+            success, mean_time, std_time = summarize_grid(df, p_name, q_name)
 
-        # all_figures.append(create_heatmap(success, p_name, q_name, f"Success rate: {p_name} vs {q_name}"))
-        all_figures.append(create_heatmap(mean_time, p_name, q_name, f"Mean time-to-depletion: {p_name} vs {q_name}"))
-        all_figures.append(create_heatmap(std_time, p_name, q_name, f"Std time-to-depletion: {p_name} vs {q_name}"))
+            # all_figures.append(create_heatmap(success, p_name, q_name, f"Success rate: {p_name} vs {q_name}"))
+            all_figures.append(create_heatmap(mean_time, p_name, q_name, f"Mean time-to-depletion: {p_name} vs {q_name}"))
+            all_figures.append(create_heatmap(std_time, p_name, q_name, f"Std time-to-depletion: {p_name} vs {q_name}"))
 
-    final_df = pd.concat(all_results, ignore_index=True)
-    final_df.to_csv("pairwise_sensitivity_results.csv", index=False)
+        final_df = pd.concat(all_results, ignore_index=True)
+        checkpoint.finish(final_df.drop(columns=['p_name', 'q_name']))
     print("Saved results to pairwise_sensitivity_results.csv")
+    # The Parquet copy keeps the pair each run belongs to, one partition per pair
+    store.save(final_df, "pairwise_sensitivity_results.csv", partition_cols=('p_name', 'q_name'))
 
-    plt.show()
+    pyplot().show()
 